@@ -0,0 +1,75 @@
+# Benchmark of the danger generation (full 48h regeneration) with different numbers of worker processes.
+# Run from the backend folder: python -m scratch.benchmark_danger [hours] [max workers]
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from server.decode_meteo_rain import decode_geojson
+from server.danger_fusion import generate_danger
+
+example_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                            "example_data", "meteo.json")
+
+wind_colors = ["#cccccc", "#59cc00", "#90cc00", "#ffffff"]
+
+
+def build_storage(storage: str, hours: int):
+    """
+    Write one rain frame and one wind frame per hour (derived from the example data) and return the jobs of a
+    full regeneration. All slots of an hour read the same rain frame.
+    """
+    with open(example_path, "r") as f:
+        rain = decode_geojson(json.load(f))
+
+    rain_path = os.path.join(storage, "rain.json")
+    with open(rain_path, "w") as f:
+        json.dump(rain, f)
+
+    jobs = []
+    for hour in range(hours):
+        wind = json.loads(json.dumps(rain))
+        for i, feature in enumerate(wind["features"]):
+            feature["properties"]["color"] = wind_colors[(i + hour) % len(wind_colors)]
+
+        wind_path = os.path.join(storage, f"wind_{hour}.json")
+        with open(wind_path, "w") as f:
+            json.dump(wind, f)
+
+        jobs.append((wind_path, [(rain_path, os.path.join(storage, f"danger_{hour}_{minute}.json"))
+                                 for minute in range(0, 60, 5)]))
+
+    return jobs
+
+
+if __name__ == "__main__":
+    hours = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    storage = tempfile.mkdtemp()
+    try:
+        jobs = build_storage(storage, hours)
+        slot_count = sum(len(slots) for _, slots in jobs)
+        print(f"{hours}h, {slot_count} slots, {os.cpu_count()} cpus")
+
+        workers = 1
+        baseline = None
+        while workers <= max_workers:
+            start = time.perf_counter()
+            written = generate_danger(jobs, workers)
+            duration = time.perf_counter() - start
+            baseline = baseline or duration
+
+            assert sum(len(paths) for paths in written) == slot_count
+            for paths in written:
+                for path in paths:
+                    os.remove(path)
+
+            print(f"{workers:3d} workers: {duration:8.2f} s, {slot_count / duration:6.1f} slots/s, "
+                  f"speedup {baseline / duration:.2f}x")
+            workers *= 2
+    finally:
+        shutil.rmtree(storage)
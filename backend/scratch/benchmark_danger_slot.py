@@ -0,0 +1,84 @@
+# Microbenchmark of the danger fusion of a single 5 minute slot: deepcopy based fusion vs. the copy-free one.
+# Run from the backend folder: python -m scratch.benchmark_danger_slot
+
+import copy
+import json
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from server.danger_fusion import fuse_danger_hour
+from scratch.benchmark_danger import build_storage
+
+
+def update_set_color(data: list, color: str):
+    for entry in data:
+        entry["properties"]["color"] = color
+
+    return data
+
+
+def legacy_fuse_danger_hour(wind_path: str, slots: list):
+    """
+    The fusion as it was before (deepcopy of the wind features per slot). Used as the reference.
+    """
+    with open(wind_path, "r") as f:
+        wind_data = json.load(f)
+
+    wind_green = list(filter(lambda x: "cccccc" in x["properties"]["color"] or "ffffff" in x["properties"]["color"],
+                             wind_data["features"]))
+    wind_yellow = list(filter(lambda x: "59cc00" in x["properties"]["color"], wind_data["features"]))
+    wind_red = list(filter(lambda x: "90cc00" in x["properties"]["color"], wind_data["features"]))
+
+    for rain_path, store_path in slots:
+        with open(rain_path, "r") as f:
+            rain_data = json.load(f)
+
+        yellow = list(filter(lambda x: x["properties"]["color"] == "#9a7e95", rain_data["features"]))
+        red = list(filter(lambda x: x["properties"]["color"] == "#0001fc", rain_data["features"]))
+
+        full_green = update_set_color(copy.deepcopy(wind_green), "#00ff00")
+        yellow.extend(copy.deepcopy(wind_yellow))
+        full_yellow = update_set_color(yellow, "#ffff00")
+        red.extend(copy.deepcopy(wind_red))
+        full_red = update_set_color(red, "#ff0000")
+
+        temp_danger = {"type": "FeatureCollection", "features": [full_green[0]] + full_yellow + full_green[1:] + full_red}
+        with open(store_path, "w") as f:
+            json.dump(temp_danger, f)
+
+
+def measure(func, wind_path: str, slots: list):
+    """
+    Time per slot (without tracing) and peak traced memory of a second run.
+    """
+    start = time.perf_counter()
+    func(wind_path, slots)
+    duration = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(wind_path, slots[:1])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration / len(slots), peak
+
+
+if __name__ == "__main__":
+    storage = tempfile.mkdtemp()
+    try:
+        (wind_path, slots), = build_storage(storage, 1)
+        legacy_slots = [(rain_path, f"{store_path}.legacy") for rain_path, store_path in slots]
+
+        t_legacy, m_legacy = measure(legacy_fuse_danger_hour, wind_path, legacy_slots)
+        t_new, m_new = measure(fuse_danger_hour, wind_path, slots)
+
+        for (_, store_path), (_, legacy_path) in zip(slots, legacy_slots):
+            with open(store_path, "rb") as a, open(legacy_path, "rb") as b:
+                assert json.load(a) == json.load(b), "copy-free fusion output differs"
+
+        print(f"deepcopy fusion:  {t_legacy * 1e3:8.1f} ms/slot, peak {m_legacy / 2 ** 20:7.1f} MiB")
+        print(f"copy-free fusion: {t_new * 1e3:8.1f} ms/slot, peak {m_new / 2 ** 20:7.1f} MiB "
+              f"({t_legacy / t_new:.1f}x faster)")
+    finally:
+        shutil.rmtree(storage)
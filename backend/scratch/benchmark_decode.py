@@ -0,0 +1,78 @@
+# Benchmark of the meteo shape decoder against example_data/meteo.json
+# Run from the backend folder: python -m scratch.benchmark_decode
+
+import json
+import os
+import timeit
+
+from server.decode_meteo_rain import decode_geojson, decode_shapes_coordinates, ch_to_wgs, calculate_orientation
+
+example_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                            "example_data", "meteo.json")
+
+
+def legacy_decode_shape_coordinates(encoded_shape, coordinates):
+    """
+    The per point decoder as it was before the numpy version. Used as the reference.
+    """
+    x_index = encoded_shape['i']
+    y_index = encoded_shape['j']
+
+    decoded_coordinates = []
+    char_index = 0
+
+    while char_index < len(encoded_shape['o']):
+        offset = int(encoded_shape['o'][char_index]) / 10 + 0.05
+
+        if x_index % 2 == 0:
+            x = coordinates['x_min'] + (coordinates['x_max'] - coordinates['x_min']) * (x_index / 2) / coordinates[
+                'x_count']
+            y = coordinates['y_min'] + (coordinates['y_max'] - coordinates['y_min']) * ((y_index - 1) / 2 + offset) / \
+                coordinates['y_count']
+        else:
+            x = coordinates['x_min'] + (coordinates['x_max'] - coordinates['x_min']) * ((x_index - 1) / 2 + offset) / \
+                coordinates['x_count']
+            y = coordinates['y_min'] + (coordinates['y_max'] - coordinates['y_min']) * (y_index / 2) / coordinates[
+                'y_count']
+
+        decoded_coordinates.append(ch_to_wgs(1e3 * x, 1e3 * y))
+
+        if 2 * char_index < len(encoded_shape['d']):
+            x_index += ord(encoded_shape['d'][2 * char_index]) - 77
+            y_index += ord(encoded_shape['d'][2 * char_index + 1]) - 77
+
+        char_index += 1
+
+    if len(decoded_coordinates) > 1 and decoded_coordinates[0] != decoded_coordinates[-1]:
+        decoded_coordinates.append(decoded_coordinates[0])
+
+    if calculate_orientation(decoded_coordinates) == "clockwise":
+        decoded_coordinates.reverse()
+
+    if len(decoded_coordinates) < 4:
+        decoded_coordinates = []
+
+    return decoded_coordinates
+
+
+if __name__ == "__main__":
+    with open(example_path, "r") as f:
+        meteo = json.load(f)
+
+    shapes = [part for area in meteo['areas'] for shape in area['shapes'] for part in shape]
+    point_count = sum(len(part['o']) for part in shapes)
+    print(f"{len(shapes)} shapes with {point_count} points")
+
+    legacy = [legacy_decode_shape_coordinates(part, meteo['coords']) for part in shapes]
+    batched = decode_shapes_coordinates(shapes, meteo['coords'])
+    assert json.dumps(legacy) == json.dumps(batched), "batched decoder output differs from the legacy decoder"
+
+    runs = 10
+    t_legacy = timeit.timeit(lambda: [legacy_decode_shape_coordinates(part, meteo['coords']) for part in shapes],
+                             number=runs) / runs
+    t_batched = timeit.timeit(lambda: decode_shapes_coordinates(shapes, meteo['coords']), number=runs) / runs
+    t_geojson = timeit.timeit(lambda: decode_geojson(meteo), number=runs) / runs
+
+    print(f"legacy decoder:  {t_legacy * 1e3:8.2f} ms")
+    print(f"batched decoder: {t_batched * 1e3:8.2f} ms ({t_legacy / t_batched:.1f}x)")
+    print(f"decode_geojson:  {t_geojson * 1e3:8.2f} ms")
@@ -0,0 +1,35 @@
+# Benchmark of the serializer (orjson if installed) against the json module on the GeoJSON of example_data/meteo.json
+# Run from the backend folder: python -m scratch.benchmark_serializer
+
+import json
+import os
+import timeit
+
+from server import serializer
+from server.decode_meteo_rain import decode_geojson
+
+example_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                            "example_data", "meteo.json")
+
+
+if __name__ == "__main__":
+    with open(example_path, "r") as f:
+        geojson = decode_geojson(json.load(f))
+
+    stdlib_text = json.dumps(geojson)
+    serialized = serializer.dumps(geojson)
+    assert serializer.loads(serialized) == json.loads(stdlib_text), "serializer output differs from json"
+
+    print(f"backend: {serializer.backend}, {len(geojson['features'])} features, "
+          f"{len(stdlib_text) / 1024:.0f} KiB (json) / {len(serialized) / 1024:.0f} KiB (serializer)")
+
+    runs = 20
+    timings = [
+        ("json.dumps", lambda: json.dumps(geojson)),
+        ("serializer.dumps", lambda: serializer.dumps(geojson)),
+        ("json.loads", lambda: json.loads(stdlib_text)),
+        ("serializer.loads", lambda: serializer.loads(serialized)),
+    ]
+    for name, func in timings:
+        duration = min(timeit.repeat(func, number=1, repeat=runs))
+        print(f"{name:>18}: {duration * 1000:8.2f} ms")
@@ -0,0 +1,82 @@
+# Benchmark of the vector tiles against serving the whole frame (bytes transferred and server cpu time) for a country
+# and a canton sized viewport of the GeoJSON of example_data/meteo.json
+# Run from the backend folder: python -m scratch.benchmark_tiles
+
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from server.decode_meteo_rain import decode_geojson
+from server.geojson_writer import write_feature_collection
+from server.frame_cache import FrameCache
+from server.vector_tiles import TileRenderer
+from server import serializer
+
+example_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                            "example_data", "meteo.json")
+
+# (name, zoom, west, south, east, north)
+viewports = [
+    ("switzerland", 7, 5.9, 45.8, 10.5, 47.8),
+    ("canton zurich", 10, 8.35, 47.15, 8.98, 47.7),
+]
+
+
+def tile_xy(lng: float, lat: float, z: int):
+    n = 2 ** z
+    lat = math.radians(lat)
+    return int((lng + 180) / 360 * n), int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n)
+
+
+def viewport_tiles(z: int, west: float, south: float, east: float, north: float):
+    x0, y0 = tile_xy(west, north, z)
+    x1, y1 = tile_xy(east, south, z)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+if __name__ == "__main__":
+    with open(example_path, "r") as f:
+        geojson = decode_geojson(json.load(f))
+
+    storage = tempfile.mkdtemp()
+    try:
+        frame_path = os.path.join(storage, "frame.json")
+        with open(frame_path, "wb") as f:
+            write_feature_collection(f, geojson["features"])
+
+        # whole frame, what the FileResponse / Response of the frame endpoints costs
+        start = time.process_time()
+        with open(frame_path, "rb") as f:
+            frame_bytes = len(f.read())
+        frame_cpu = time.process_time() - start
+        print(f"{'whole frame':>24}: {frame_bytes / 1024:8.0f} KiB, {frame_cpu * 1000:8.1f} ms cpu")
+
+        for name, z, west, south, east, north in viewports:
+            tiles = viewport_tiles(z, west, south, east, north)
+            renderer = TileRenderer(max_frames=1)
+            cache = FrameCache(max_bytes=64 * 1024 * 1024)
+
+            def load() -> dict:
+                with open(frame_path, "rb") as f:
+                    return serializer.load(f)
+
+            for label in ("cold", "cached"):
+                start = time.process_time()
+                total = 0
+                for x, y in tiles:
+                    cached = cache.get((z, x, y))
+                    if cached is None:
+                        data = renderer.render("frame", load, z, x, y)
+                        cache.put((z, x, y), None, data)
+                    else:
+                        data = cached[1]
+                    total += len(data)
+                cpu = time.process_time() - start
+
+                print(f"{name + ' ' + label:>24}: {total / 1024:8.0f} KiB, {cpu * 1000:8.1f} ms cpu "
+                      f"({len(tiles)} tiles at z{z}, {frame_bytes / total:.1f}x fewer bytes)")
+    finally:
+        shutil.rmtree(storage)
@@ -1,24 +1,40 @@
 import json
 import os
 import datetime
+import time
 import warnings
+from typing import Any, Callable, Dict, Iterator, Tuple, Union
 
 import pytz
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.staticfiles import StaticFiles
-from starlette.responses import FileResponse
+from starlette.responses import FileResponse, Response, StreamingResponse
+from server import serializer, precompress, frame_binary, vector_tiles, simplify, blob_store
 from server.config import ServerConfig
+from server.frame_cache import FrameCache
+from server.timeline_index import TimelineIndex
 
 import server.mongo_db_common as mdbc
 from server.mongo_db_api import MongoAPI, string_to_object_id, object_id_to_string
+from server.mongodb_data_models import RainRecord, RainRecordType
 
 
 storage_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 config_path = os.path.join(storage_path, "server_config.json")
 
 
+class SerializedJSONResponse(Response):
+    """
+    JSON response rendered by the serializer (orjson if available).
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return serializer.dumps(content)
+
+
 app = FastAPI(title="Weather Fusion", version="0.1.0")
-api_app = FastAPI(title="Weather Fusion API", version="0.1.0")
+api_app = FastAPI(title="Weather Fusion API", version="0.1.0", default_response_class=SerializedJSONResponse)
 
 
 if not os.path.exists(config_path):
@@ -31,6 +47,14 @@ with open(config_path, "r") as f:
 
     mongo = MongoAPI(db_address=server_config.mongo_db.address, db_name=server_config.mongo_db.database,
                      db_username=server_config.mongo_db.username, db_password=server_config.mongo_db.password)
+    mdbc.ensure_indexes(mongo)
+
+
+frame_cache = FrameCache(max_bytes=server_config.api.cache_bytes)
+tile_cache = FrameCache(max_bytes=server_config.api.tile_cache_bytes)
+tile_renderer = vector_tiles.TileRenderer(max_frames=server_config.api.tile_frames)
+timeline = TimelineIndex()
+last_cache_check = 0.0
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -44,8 +68,218 @@ def gen_dt(five_minutes: int):
     return now + datetime.timedelta(minutes=five_minutes*5)
 
 
+def refresh_timeline():
+    """
+    Add the records the crawler committed since the last refresh to the timeline index and invalidate the frame
+    cache if a newer prediction version has been ingested. The database is checked at most every
+    api.cache_check_interval seconds.
+    """
+    global last_cache_check
+
+    now = time.monotonic()
+    if now - last_cache_check < server_config.api.cache_check_interval:
+        return
+    last_cache_check = now
+
+    timeline.refresh(mongo)
+    frame_cache.validate((timeline.rain_version, timeline.wind_version))
+
+
+def load_frame(product: str, dt: datetime.datetime, lookup: Callable, extension: str,
+               encoding: str = "identity", detail: int = 0) -> Tuple[Any, bytes, str, int]:
+    """
+    Resolve the record of a product for the given date and load its file, served from the frame cache if possible.
+
+    The record is resolved through the timeline index, the database is only queried if the index doesn't know the
+    slot or the indexed record has been pruned. Missing siblings of GeoJSON frames are built on first request.
+
+    :param product: name of the product (timeline and cache key)
+    :param dt: date of the frame
+    :param lookup: function of mongo_db_common resolving the record
+    :param extension: file extension of the stored frame
+    :param encoding: content-coding to serve (precompressed sibling of the frame)
+    :param detail: level of detail to serve (see simplify)
+    :return: the record, the file content, its content-coding and level of detail
+    """
+    refresh_timeline()
+
+    record = timeline.resolve(product, dt)
+    key = (product, dt, detail, encoding)
+    cached = frame_cache.get(key)
+    if cached is not None and record is not None and cached[0].record_id == record.record_id:
+        return cached[0], cached[1], encoding, detail
+
+    if record is not None:
+        data = load_stored_frame(blob_store.frame_name(record), extension, encoding, detail)
+        if data is not None:
+            frame_cache.put(key, record, data)
+            return record, data, encoding, detail
+
+        # record has been pruned
+        timeline.forget(product, dt)
+
+    record = lookup(mongo, dt)
+    if record is None:
+        raise HTTPException(404, "Record not found")
+
+    # the cached frame may belong to a superseded record
+    if cached is not None and cached[0].record_id == record.record_id:
+        return cached[0], cached[1], encoding, detail
+
+    data = load_stored_frame(blob_store.frame_name(record), extension, encoding, detail)
+    if data is None:
+        raise HTTPException(status_code=500, detail="Data not found")
+
+    frame_cache.put(key, record, data)
+    return record, data, encoding, detail
+
+
+def frame_path(name: str, extension: str, encoding: str = "identity", detail: int = 0) -> str:
+    """
+    Path of a stored frame (name from blob_store.frame_name) in a content-coding and level of detail.
+    """
+    path = os.path.join(storage_path, "storage", f"{name}.{extension}{simplify.detail_suffix(detail)}")
+    return precompress.encoded_path(path, encoding)
+
+
+def read_frame(name: str, extension: str, encoding: str = "identity", detail: int = 0) -> Union[bytes, None]:
+    """
+    Read a stored frame (name from blob_store.frame_name), None if the file doesn't exist.
+    """
+    try:
+        with open(frame_path(name, extension, encoding, detail), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def load_stored_frame(name: str, extension: str, encoding: str = "identity", detail: int = 0) -> Union[bytes, None]:
+    """
+    Read a stored frame like read_frame, a missing sibling of a GeoJSON frame (i.e. the levels of detail of the
+    danger frames) is written on first request.
+    """
+    data = read_frame(name, extension, encoding, detail)
+    if data is None and extension == "json" and (encoding != "identity" or detail != 0):
+        data = precompress.write_sibling(frame_path(name, extension), encoding, detail)
+
+    return data
+
+
+def resolve_record(product: str, dt: datetime.datetime, lookup: Callable) -> Any:
+    """
+    Resolve the record of a product for the given date without reading its file.
+    """
+    refresh_timeline()
+
+    record = timeline.resolve(product, dt)
+    if record is None:
+        record = lookup(mongo, dt)
+    if record is None:
+        raise HTTPException(404, "Record not found")
+
+    return record
+
+
+def frame_etag(record_id: str, encoding: str, detail: int = 0) -> str:
+    """
+    Strong ETag of a frame. The files are never modified (a new version gets a new record id), every level of detail
+    and content-coding gets its own tag.
+    """
+    parts = [record_id]
+    if detail != 0:
+        parts.append(f"d{detail}")
+    if encoding != "identity":
+        parts.append(encoding)
+    return '"' + "-".join(parts) + '"'
+
+
+def etag_matches(if_none_match: Union[str, None], etag: str) -> bool:
+    """
+    Check an If-None-Match header (*, or a comma separated list of strong or weak tags) against the ETag of the
+    representation that would be served.
+    """
+    if not if_none_match:
+        return False
+
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+
+    return False
+
+
+def resolve_detail(detail: Union[int, None], zoom: Union[int, None]) -> int:
+    """
+    Level of detail of a request, given directly or by the map zoom. Full resolution if neither is given.
+    """
+    if detail is None:
+        detail = simplify.detail_for_zoom(zoom) if zoom is not None else 0
+
+    if not 0 <= detail <= len(simplify.grids):
+        raise HTTPException(status_code=400, detail=f"detail must be between 0 and {len(simplify.grids)}")
+
+    return detail
+
+
+def cache_control(record: Any) -> str:
+    """
+    Cache-Control of a frame. Past radar frames never change, predictions are superseded by newer versions.
+    The endpoints address frames relative to now, so max-age never outlasts the current 5 minute slot.
+    """
+    slot_left = max(1, int((gen_dt(1) - datetime.datetime.now(datetime.timezone.utc)).total_seconds()))
+
+    if isinstance(record, RainRecord) and record.type == RainRecordType.radar:
+        return f"public, max-age={min(server_config.api.radar_max_age, slot_left)}, immutable"
+
+    return f"public, max-age={min(server_config.api.prediction_max_age, slot_left)}"
+
+
+def frame_response(product: str, dt: datetime.datetime, lookup: Callable, extension: str, media_type: str,
+                   accept_encoding: Union[str, None] = None, if_none_match: Union[str, None] = None,
+                   accept: Union[str, None] = None, detail: int = 0) -> Response:
+    """
+    Serve a frame with validators. GeoJSON frames are served as wfb (see frame_binary) if the client asks for it in
+    Accept, otherwise in the best content-coding the client accepts, at the requested level of detail.
+    Conditional requests with a matching ETag are answered with 304 without reading the file.
+    """
+    if extension == "json":
+        if frame_binary.accepts(accept):
+            encoding = frame_binary.encoding
+        else:
+            encoding = precompress.choose_encoding(accept_encoding)
+        headers = {"Vary": "Accept, Accept-Encoding"}
+    else:
+        encoding = "identity"
+        headers = {}
+
+    if if_none_match:
+        record = resolve_record(product, dt, lookup)
+        etag = frame_etag(record.record_id, encoding, detail)
+        if etag_matches(if_none_match, etag):
+            headers["ETag"] = etag
+            headers["Cache-Control"] = cache_control(record)
+            return Response(status_code=304, headers=headers)
+
+    record, data, encoding, detail = load_frame(product, dt, lookup, extension, encoding, detail)
+
+    headers["ETag"] = frame_etag(record.record_id, encoding, detail)
+    headers["Cache-Control"] = cache_control(record)
+    if encoding == frame_binary.encoding:
+        media_type = frame_binary.media_type
+    elif encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
 @api_app.get("/get-rain-data")
-def get_rain(five_minutes: int):
+def get_rain(five_minutes: int, accept_encoding: Union[str, None] = Header(None),
+             if_none_match: Union[str, None] = Header(None), accept: Union[str, None] = Header(None),
+             detail: Union[int, None] = None, zoom: Union[int, None] = None):
     """
     Get the rain data for a specific date
     """
@@ -54,19 +288,14 @@ def get_rain(five_minutes: int):
         raise HTTPException(status_code=400, detail="Date must be a multiple of 5 minutes")
 
     # check if it exists in the radar data:
-    record = mdbc.get_rain_record(mongo, dt)
-    if record is None:
-        raise HTTPException(404, "Record not found")
-    path = os.path.join(storage_path, "storage", f"{record.record_id}.json")
-
-    if os.path.exists(path):
-        return FileResponse(path)
-
-    raise HTTPException(status_code=500, detail="Data not found")
+    return frame_response("rain", dt, mdbc.get_rain_record, "json", "application/json", accept_encoding, if_none_match,
+                          accept, resolve_detail(detail, zoom))
 
 
 @api_app.get("/get-wind-speed")
-def get_wind_speed(five_minutes: int):
+def get_wind_speed(five_minutes: int, accept_encoding: Union[str, None] = Header(None),
+                   if_none_match: Union[str, None] = Header(None), accept: Union[str, None] = Header(None),
+                   detail: Union[int, None] = None, zoom: Union[int, None] = None):
     """
     Get the wind speed json from the database with the newest date.
     """
@@ -74,21 +303,12 @@ def get_wind_speed(five_minutes: int):
     if dt.minute != 0 or dt.second != 0:
         raise HTTPException(status_code=400, detail="Wind only available hourly.")
 
-    # check if it exists in the radar data:
-    record = mdbc.get_wind_speed(mongo, dt)
-    if record is None:
-        raise HTTPException(404, "Record not found")
-
-    path = os.path.join(storage_path, "storage", f"{record.record_id}.json")
-
-    if os.path.exists(path):
-        return FileResponse(path)
-
-    raise HTTPException(status_code=500, detail="Data not found")
+    return frame_response("wind_speed", dt, mdbc.get_wind_speed, "json", "application/json", accept_encoding,
+                          if_none_match, accept, resolve_detail(detail, zoom))
 
 
 @api_app.get("/get-wind-direction")
-def get_wind_direction(five_minutes: int):
+def get_wind_direction(five_minutes: int, if_none_match: Union[str, None] = Header(None)):
     """
     Get the wind direction png from the database with the newest date.
     """
@@ -96,22 +316,15 @@ def get_wind_direction(five_minutes: int):
     if dt.minute != 0 or dt.second != 0:
         raise HTTPException(status_code=400, detail="Wind only available hourly.")
 
-    # check if it exists in the radar data:
-    record = mdbc.get_wind_direction(mongo, dt)
-    if record is None:
-        raise HTTPException(404, "Record not found")
-
-    path = os.path.join(storage_path, "storage", f"{record.record_id}.png")
-
-    if os.path.exists(path):
-        warnings.warn("Sending png file - will switch to geojson soon")
-        return FileResponse(path)
-
-    raise HTTPException(status_code=500, detail="Data not found")
+    warnings.warn("Sending png file - will switch to geojson soon")
+    return frame_response("wind_direction", dt, mdbc.get_wind_direction, "png", "image/png",
+                          if_none_match=if_none_match)
 
 
 @api_app.get("/get-danger-noodle")
-def get_danger_noodle(five_minutes: int):
+def get_danger_noodle(five_minutes: int, accept_encoding: Union[str, None] = Header(None),
+                      if_none_match: Union[str, None] = Header(None), accept: Union[str, None] = Header(None),
+                      detail: Union[int, None] = None, zoom: Union[int, None] = None):
     """
     Get the danger areas for the given date.
     """
@@ -119,17 +332,140 @@ def get_danger_noodle(five_minutes: int):
     if dt.minute % 5 != 0:
         raise HTTPException(status_code=400, detail="danger is available every 5 min")
 
-    # check if it exists in the radar data:
-    record = mdbc.get_danger_record(mongo, dt)
-    if record is None:
-        raise HTTPException(404, "Record not found")
+    return frame_response("danger", dt, mdbc.get_danger_record, "json", "application/json", accept_encoding,
+                          if_none_match, accept, resolve_detail(detail, zoom))
+
 
-    path = os.path.join(storage_path, "storage", f"{record.record_id}.json")
+def range_slots(start: int, end: int) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    Validate a range of five_minutes offsets (both inclusive) and return the [start, end) dates of it.
+    """
+    if end < start:
+        raise HTTPException(status_code=400, detail="to must not be before from")
+    if end - start + 1 > server_config.api.max_range_slots:
+        raise HTTPException(status_code=400, detail=f"At most {server_config.api.max_range_slots} slots per request")
+
+    start_dt = gen_dt(start)
+    return start_dt, start_dt + datetime.timedelta(minutes=(end - start + 1) * 5)
+
+
+def stream_frames(product: str, start: int, start_dt: datetime.datetime,
+                  records: Dict[datetime.datetime, Any], detail: int = 0) -> Iterator[bytes]:
+    """
+    Stream the frames of a range as NDJSON, one line per slot with a record:
+    {"five_minutes": n, "dt": ..., "record_id": ..., "frame": <GeoJSON>}. The stored GeoJSON (at the level of detail,
+    built on first request if it's missing) is embedded as is, frames are taken from the frame cache if possible. Slots
+    without a record or file are left out.
+    """
+    for dt in sorted(records):
+        record = records[dt]
+        key = (product, dt, detail, "identity")
+
+        cached = frame_cache.get(key)
+        if cached is not None and cached[0].record_id == record.record_id:
+            data = cached[1]
+        else:
+            data = load_stored_frame(blob_store.frame_name(record), "json", detail=detail)
+            if data is None:
+                continue
+            frame_cache.put(key, record, data)
+
+        five_minutes = start + int((dt - start_dt).total_seconds()) // 300
+        yield (b'{"five_minutes":' + str(five_minutes).encode() + b',"dt":"' + dt.isoformat().encode()
+               + b'","record_id":"' + record.record_id.encode() + b'","frame":' + data + b"}\n")
+
+
+@api_app.get("/rain-range")
+def get_rain_range(start: int = Query(alias="from"), end: int = Query(alias="to"), detail: Union[int, None] = None,
+                   zoom: Union[int, None] = None):
+    """
+    Get the rain data of all slots from five_minutes=from to five_minutes=to (inclusive) as NDJSON.
+    The records are resolved with one query.
+    """
+    start_dt, end_dt = range_slots(start, end)
+    detail = resolve_detail(detail, zoom)
+    refresh_timeline()
 
-    if os.path.exists(path):
-        return FileResponse(path)
+    records = mdbc.get_rain_records_in_range(mongo, start_dt, end_dt)
+    return StreamingResponse(stream_frames("rain", start, start_dt, records, detail),
+                             media_type="application/x-ndjson")
 
-    raise HTTPException(status_code=500, detail="Data not found")
+
+@api_app.get("/danger-range")
+def get_danger_range(start: int = Query(alias="from"), end: int = Query(alias="to"), detail: Union[int, None] = None,
+                     zoom: Union[int, None] = None):
+    """
+    Get the danger areas of all slots from five_minutes=from to five_minutes=to (inclusive) as NDJSON.
+    The records are resolved with one query.
+    """
+    start_dt, end_dt = range_slots(start, end)
+    detail = resolve_detail(detail, zoom)
+    refresh_timeline()
+
+    records = mdbc.get_danger_records_in_range(mongo, start_dt, end_dt)
+    return StreamingResponse(stream_frames("danger", start, start_dt, records, detail),
+                             media_type="application/x-ndjson")
+
+
+# tile product -> (timeline product, lookup, slot length in minutes)
+tile_products = {
+    "rain": ("rain", mdbc.get_rain_record, 5),
+    "wind-speed": ("wind_speed", mdbc.get_wind_speed, 60),
+    "danger": ("danger", mdbc.get_danger_record, 5),
+}
+
+
+@api_app.get("/tiles/{product}/{z}/{x}/{y}")
+def get_tile(product: str, z: int, x: int, y: int, five_minutes: int,
+             accept_encoding: Union[str, None] = Header(None), if_none_match: Union[str, None] = Header(None)):
+    """
+    Get a vector tile (GeoJSON, clipped to the tile and simplified for the zoom) of a frame, in the best
+    content-coding the client accepts. Tiles are cached by the record id of the frame and the content-coding.
+    """
+    if product not in tile_products:
+        raise HTTPException(status_code=404, detail="Unknown product")
+    if not vector_tiles.valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+
+    timeline_product, lookup, slot_minutes = tile_products[product]
+    dt = gen_dt(five_minutes)
+    if dt.minute % slot_minutes != 0:
+        raise HTTPException(status_code=400, detail=f"{product} is available every {slot_minutes} min")
+
+    record = resolve_record(timeline_product, dt, lookup)
+    encoding = precompress.choose_encoding(accept_encoding)
+    headers = {"ETag": frame_etag(f"{record.record_id}-{z}-{x}-{y}", encoding), "Cache-Control": cache_control(record),
+               "Vary": "Accept-Encoding"}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
+    key = (record.record_id, z, x, y, encoding)
+    cached = tile_cache.get(key)
+    if cached is not None:
+        return Response(content=cached[1], media_type="application/json", headers=headers)
+
+    def load_geojson() -> dict:
+        data = read_frame(blob_store.frame_name(record), "json")
+        if data is None:
+            raise HTTPException(status_code=500, detail="Data not found")
+        return serializer.loads(data)
+
+    data = tile_renderer.render(record.record_id, load_geojson, z, x, y)
+    if encoding != "identity":
+        data = precompress.encodings[encoding][1](data)
+    tile_cache.put(key, record, data)
+    return Response(content=data, media_type="application/json", headers=headers)
+
+
+@api_app.get("/cache-stats")
+def get_cache_stats():
+    """
+    Get the hit / miss counters of the frame cache and the tile cache.
+    """
+    return {**frame_cache.stats(), "tiles": tile_cache.stats()}
 
 
 main = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "webinterface",
@@ -0,0 +1,117 @@
+"""
+Content addressed storage of the frames. A frame is stored once as storage/{sha256 of the file}.{extension} (with its
+siblings, see precompress) and the records reference it by digest, so the runs of identical frames (empty radar frames
+of dry periods, predictions repeated by the next version) share one file. A blob is removed by the storage reconciler
+once no record references it anymore. There is no reference count: a blob reused while it is removed is protected by
+the claim of the reconciler and the touch of commit_frames (see storage_reconciler).
+
+Records written before the blobs have no digest, their frames are stored as storage/{record_id}.{extension}.
+"""
+import hashlib
+import os
+from typing import List, Set, Tuple, Union
+
+from server import precompress
+from server.mongodb_data_models import RainRecord, WindRecord, DangerRecord
+
+
+def file_digest(path: str) -> str:
+    """
+    Sha256 hex digest of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def blob_path(path: str, digest: str, extension: str) -> str:
+    """
+    Path of the blob with the given digest, in the folder of path.
+    """
+    return os.path.join(os.path.dirname(path), f"{digest}.{extension}")
+
+
+def frame_name(record: Union[RainRecord, WindRecord, DangerRecord]) -> str:
+    """
+    Name (without extension) of the stored frame of a record.
+    """
+    return record.digest if record.digest is not None else record.record_id
+
+
+def prepare_frame(path: str, prepared: Set[str] = None, details: bool = True) -> str:
+    """
+    Write the siblings of a freshly written GeoJSON frame, unless the same frame is already stored.
+
+    :param path: the frame
+    :param prepared: digests of the frames already prepared in the same batch (committed in order, so only the first
+        of the batch needs the siblings), updated in place
+    :param details: write the binary sibling and the levels of detail as well (see precompress.write_siblings)
+    :return: the digest of the frame
+    """
+    digest = file_digest(path)
+    if prepared is not None:
+        if digest in prepared:
+            return digest
+        prepared.add(digest)
+
+    if not os.path.exists(blob_path(path, digest, "json")):
+        precompress.write_siblings(path, details)
+
+    return digest
+
+
+def commit_frames(paths: List[str], extension: str) -> List[str]:
+    """
+    Move written frames (and their siblings) to their blobs, frames that are already stored are removed. The records
+    referencing the digests need to be inserted within the grace period of the storage reconciler.
+
+    :param paths: the written frames
+    :param extension: the extension of the frames
+    :return: the digest of every frame
+    """
+    digests = [file_digest(path) for path in paths]
+
+    for path, digest in zip(paths, digests):
+        target = blob_path(path, digest, extension)
+        try:
+            # touched (main file first, see storage_reconciler), so the storage reconciler keeps it until the record
+            # referencing it is inserted
+            os.utime(target)
+        except FileNotFoundError:
+            # not stored or claimed for removal by the storage reconciler, the copy takes its place
+            precompress.rename_frame(path, target)
+            continue
+
+        for suffix in precompress.sibling_suffixes:
+            try:
+                os.utime(target + suffix)
+            except FileNotFoundError:
+                pass
+        precompress.remove_frame(path)
+
+    return digests
+
+
+def commit_frame(path: str, extension: str) -> str:
+    """
+    Move a written frame to its blob, see commit_frames.
+
+    :return: the digest of the frame
+    """
+    return commit_frames([path], extension)[0]
+
+
+def owned_frames(storage: str, frames: List[Tuple[str, Union[None, str], str]]) -> List[str]:
+    """
+    Get the paths of the frames owned by removed records. Records without digest own their frame, blobs are shared
+    and only removed by the storage reconciler.
+
+    :param storage: the storage folder
+    :param frames: (record id, digest, extension) of every removed record
+    :return: paths of the frames to be removed with precompress.remove_frame
+    """
+    return [os.path.join(storage, f"{record_id}.{extension}") for record_id, digest, extension in frames
+            if digest is None]
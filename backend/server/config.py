@@ -1,3 +1,5 @@
+from typing import Union
+
 from pydantic import BaseModel
 
 
@@ -8,6 +10,51 @@ class MongoDBAccess(BaseModel):
     database: str
 
 
+class TaskSchedule(BaseModel):
+    interval: Union[None, int]
+    timeout: int
+
+
+class CrawlerConfig(BaseModel):
+    upstream_url: str = "https://www.meteoschweiz.admin.ch/product/output"
+    fetch_workers: int = 8
+    decode_workers: int = 2
+    danger_workers: int = 2
+    versions: TaskSchedule = TaskSchedule(interval=60, timeout=60)
+    radar: TaskSchedule = TaskSchedule(interval=60, timeout=900)
+    # a radar slot answered with 404 is retried after radar_retry seconds, doubling per miss up to radar_retry_max.
+    # Slots newer than radar_publish_lag seconds are not published yet and retried with every run.
+    radar_retry: int = 60
+    radar_retry_max: int = 3600
+    radar_publish_lag: int = 600
+    rain_prediction: TaskSchedule = TaskSchedule(interval=1800, timeout=3600)
+    wind_prediction: TaskSchedule = TaskSchedule(interval=1800, timeout=3600)
+    danger: TaskSchedule = TaskSchedule(interval=None, timeout=3600)
+
+
+class ApiConfig(BaseModel):
+    cache_bytes: int = 256 * 1024 * 1024
+    cache_check_interval: int = 10
+    radar_max_age: int = 86400
+    prediction_max_age: int = 60
+    max_range_slots: int = 600
+    tile_cache_bytes: int = 64 * 1024 * 1024
+    tile_frames: int = 8
+
+
+class PrunerConfig(BaseModel):
+    unlink_workers: int = 8
+    prediction_interval: int = 1800
+    reconcile_interval: int = 60
+    reconcile_batch: int = 5000
+    # a frame is written before its record is inserted, the danger frames of a whole regeneration are committed at
+    # its end
+    orphan_grace: int = 3600
+
+
 class ServerConfig(BaseModel):
     mongo_db: MongoDBAccess
     data_home: str
+    crawler: CrawlerConfig = CrawlerConfig()
+    api: ApiConfig = ApiConfig()
+    pruner: PrunerConfig = PrunerConfig()
@@ -0,0 +1,172 @@
+import asyncio
+import datetime
+import json
+import os
+import time
+import traceback
+from typing import Callable, Any, Union, List, Dict
+
+from pydantic import BaseModel
+
+
+class TaskStats(BaseModel):
+    runs: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    skipped: int = 0
+    running: bool = False
+    last_start: Union[None, datetime.datetime] = None
+    last_duration: Union[None, float] = None
+    last_result: Union[None, str] = None
+
+
+class CrawlerTask:
+    name: str
+    func: Callable[[], Any]
+    interval: Union[None, float]
+    timeout: float
+    triggers: List["CrawlerTask"]
+    stats: TaskStats
+
+    def __init__(self, name: str, func: Callable[[], Any], interval: Union[None, float], timeout: float,
+                 triggers: List["CrawlerTask"] = None):
+        """
+        :param name: name of the task (used in the stats)
+        :param func: blocking function to run, it is executed in a worker thread
+        :param interval: seconds between two runs, None to only run when triggered by another task
+        :param timeout: seconds after which the task is no longer awaited
+        :param triggers: tasks to trigger if func returns a truthy value (i.e. new data was ingested)
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.timeout = timeout
+        self.triggers = triggers if triggers is not None else []
+        self.stats = TaskStats()
+
+        self._loop: Union[None, asyncio.AbstractEventLoop] = None
+        self._event: Union[None, asyncio.Event] = None
+        self._worker: Union[None, asyncio.Future] = None
+
+    def trigger(self):
+        """
+        Run the task as soon as possible (independent of the interval). Safe to call from worker threads.
+        """
+        if self._event is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def _wait_next(self):
+        """
+        Wait until the interval has passed or the task is triggered.
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=self.interval)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+    async def run_once(self):
+        """
+        Run the function in a worker thread and update the stats.
+
+        A worker thread can't be killed, so after a timeout the thread keeps running in the background and further
+        runs are skipped until it has finished.
+        """
+        if self._worker is not None and not self._worker.done():
+            self.stats.skipped += 1
+            print(f"{self.name}: previous run still in progress, skipping")
+            return
+
+        start = time.monotonic()
+        self.stats.runs += 1
+        self.stats.running = True
+        self.stats.last_start = datetime.datetime.now(datetime.UTC)
+        self._worker = asyncio.ensure_future(asyncio.to_thread(self.func))
+        self._worker.add_done_callback(self._worker_done)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(self._worker), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            self.stats.last_result = "timeout"
+            print(f"{self.name}: timed out after {self.timeout}s")
+            return
+        except Exception:
+            self.stats.failures += 1
+            self.stats.last_result = "failed"
+            traceback.print_exc()
+            return
+        finally:
+            self.stats.last_duration = time.monotonic() - start
+
+        self.stats.last_result = "ok"
+
+    def _worker_done(self, worker: asyncio.Future):
+        """
+        Called once the worker thread finished (also if it's no longer awaited due to a timeout).
+        """
+        self.stats.running = False
+        if not worker.cancelled() and worker.exception() is None and worker.result():
+            for task in self.triggers:
+                task.trigger()
+
+    async def run(self):
+        """
+        Run the task forever. Tasks with an interval run right away, the others wait for the first trigger.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        if self.interval is None:
+            await self._wait_next()
+
+        while True:
+            await self.run_once()
+            await self._wait_next()
+
+
+class CrawlerScheduler:
+    tasks: List[CrawlerTask]
+    stats_path: Union[None, str]
+
+    def __init__(self, tasks: List[CrawlerTask], stats_path: str = None, stats_interval: float = 60):
+        """
+        :param tasks: tasks to run, each one runs independently with its own cadence and timeout
+        :param stats_path: json file the per task stats are written to (None to only print them)
+        :param stats_interval: seconds between two stats reports
+        """
+        self.tasks = tasks
+        self.stats_path = stats_path
+        self.stats_interval = stats_interval
+
+    def stats(self) -> Dict[str, TaskStats]:
+        """
+        Get the stats of all tasks.
+        """
+        return {task.name: task.stats for task in self.tasks}
+
+    def report_stats(self):
+        """
+        Print the stats and write them to the stats file.
+        """
+        stats = {name: s.model_dump(mode="json") for name, s in self.stats().items()}
+
+        for name, s in stats.items():
+            print(f"{name}: runs {s['runs']}, failures {s['failures']}, timeouts {s['timeouts']}, "
+                  f"last run {s['last_start']} ({s['last_result']}, {s['last_duration']}s)")
+
+        if self.stats_path is not None:
+            temp_path = f"{self.stats_path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(stats, f, indent=2)
+            os.replace(temp_path, self.stats_path)
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self.report_stats()
+
+    async def run(self):
+        """
+        Run all tasks until cancelled.
+        """
+        await asyncio.gather(self._report_loop(), *(task.run() for task in self.tasks))
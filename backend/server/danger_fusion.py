@@ -0,0 +1,109 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+from server import serializer, blob_store
+from server.geojson_writer import write_serialized_features
+
+
+def recolored_json(features: list, color: str) -> Iterator[bytes]:
+    """
+    Serialize the features with a different color. The features aren't copied or modified, only the properties
+    are replaced, the geometry (coordinates) is shared.
+    """
+    return (serializer.dumps({**feature, "properties": {**feature["properties"], "color": color}})
+            for feature in features)
+
+
+def split_wind_features(features: list) -> Tuple[list, list, list]:
+    """
+    Split the wind features into green, yellow and red in one pass.
+    """
+    green, yellow, red = [], [], []
+    for feature in features:
+        color = feature["properties"]["color"]
+        if "cccccc" in color or "ffffff" in color:
+            green.append(feature)
+        if "59cc00" in color:
+            yellow.append(feature)
+        if "90cc00" in color:
+            red.append(feature)
+
+    return green, yellow, red
+
+
+def split_rain_features(features: list) -> Tuple[list, list]:
+    """
+    Split the rain features into yellow and red in one pass.
+    """
+    yellow, red = [], []
+    for feature in features:
+        color = feature["properties"]["color"]
+        if color == "#9a7e95":
+            yellow.append(feature)
+        elif color == "#0001fc":
+            red.append(feature)
+
+    return yellow, red
+
+
+def fuse_danger_hour(wind_path: str, slots: List[Tuple[str, str]]) -> List[str]:
+    """
+    Fuse the wind data of one hour with the rain data of its 5 minute slots and write the danger data.
+
+    The recolored wind features are serialized once per hour, per slot only the rain features are serialized and
+    everything is written straight to the output. The output is the same as serializer.dump of the fused
+    FeatureCollection. The siblings (compressed, binary) of every output are written too.
+
+    :param wind_path: path of the wind strength GeoJSON
+    :param slots: list of (rain GeoJSON path, path to write the danger GeoJSON to)
+    :return: the paths written
+    """
+    with open(wind_path, "rb") as f:
+        wind_data = serializer.load(f)
+
+    wind_green, wind_yellow, wind_red = split_wind_features(wind_data["features"])
+    green_json = list(recolored_json(wind_green, "#00ff00"))
+    wind_yellow_json = list(recolored_json(wind_yellow, "#ffff00"))
+    wind_red_json = list(recolored_json(wind_red, "#ff0000"))
+
+    # only the serialized wind features are needed from here on
+    del wind_data, wind_green, wind_yellow, wind_red
+
+    written = []
+    prepared = set()
+    for rain_path, store_path in slots:
+        with open(rain_path, "rb") as f:
+            rain_data = serializer.load(f)
+
+        # Extract yellow and red feature from rain
+        yellow, red = split_rain_features(rain_data["features"])
+
+        # green[0], yellow (rain, wind), green[1:], red (rain, wind), the rain features are serialized while writing
+        features = itertools.chain([green_json[0]], recolored_json(yellow, "#ffff00"), wind_yellow_json,
+                                   green_json[1:], recolored_json(red, "#ff0000"), wind_red_json)
+
+        # write to disk
+        with open(store_path, "wb") as f:
+            write_serialized_features(f, features)
+        # the levels of detail and the binary sibling are built by the api on first request
+        blob_store.prepare_frame(store_path, prepared, details=False)
+
+        written.append(store_path)
+
+    return written
+
+
+def generate_danger(jobs: List[Tuple[str, List[Tuple[str, str]]]], workers: int) -> List[List[str]]:
+    """
+    Run fuse_danger_hour for every job, fanned out over a process pool.
+
+    :param jobs: list of (wind path, slots) - see fuse_danger_hour
+    :param workers: number of worker processes, the jobs run in this process if <= 1
+    :return: the paths written, per job
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [fuse_danger_hour(wind_path, slots) for wind_path, slots in jobs]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(fuse_danger_hour, *zip(*jobs)))
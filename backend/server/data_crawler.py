@@ -1,16 +1,24 @@
+import asyncio
 import datetime
 import json
 import os.path
 import time
 import warnings
-import copy
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 
 import pytz
 import requests as rq
-from typing import Tuple, Union
+from requests.adapters import HTTPAdapter
+from typing import List, Set, Tuple, Union
 
-from server.decode_meteo_rain import decode_geojson
+from server import serializer, blob_store, precompress
+from server.decode_meteo_rain import iter_geojson_features
+from server.geojson_writer import write_feature_collection
+from server.danger_fusion import generate_danger
 from server.config import ServerConfig
+from server.crawler_scheduler import CrawlerScheduler, CrawlerTask
+from server.version_watcher import VersionWatcher
+from server.slot_tracker import SlotBackoff, SlotTracker
 from server.mongo_db_api import MongoAPI, string_to_object_id, object_id_to_string
 import server.mongo_db_common as mdbc
 from server.mongodb_data_models import *
@@ -18,7 +26,9 @@ from server.mongodb_data_models import *
 # ----------------------------------------------------------------------------------------------------------------------
 # GLOBALS
 # ----------------------------------------------------------------------------------------------------------------------
-config_path = "/home/alisot2000/Documents/02_ETH/FWE/Weather-fusion/backend/data/server_config.json"
+# WEATHER_FUSION_CONFIG overrides the config location (i.e. for the tests)
+config_path = os.environ.get("WEATHER_FUSION_CONFIG",
+                             "/home/alisot2000/Documents/02_ETH/FWE/Weather-fusion/backend/data/server_config.json")
 
 if not os.path.exists(config_path):
     raise FileNotFoundError("Please create the server_config.json file in the data folder")
@@ -29,6 +39,27 @@ with open(config_path, "r") as f:
     server_config = ServerConfig.model_validate(d)
     mongo = MongoAPI(db_address=server_config.mongo_db.address, db_name=server_config.mongo_db.database,
                      db_username=server_config.mongo_db.username, db_password=server_config.mongo_db.password)
+    mdbc.ensure_indexes(mongo)
+
+# Pooled session shared by all requests to meteoswiss
+upstream_url = server_config.crawler.upstream_url
+http_session = rq.Session()
+http_session.mount("https://", HTTPAdapter(pool_maxsize=server_config.crawler.fetch_workers))
+http_session.mount("http://", HTTPAdapter(pool_maxsize=server_config.crawler.fetch_workers))
+
+# versions.json is shared by all products, so it's only polled once per cycle
+version_keys = {
+    RecordType.rain: "inca/precipitation/rate",
+    RecordType.wind_10m: "cosmo/wind-10m/images",
+    RecordType.wind_2000m: "cosmo/wind-2000m/images",
+}
+version_watcher = VersionWatcher(http_session, f"{upstream_url}/versions.json")
+
+# 5 minute slots whose rain or wind input changed, the danger task only regenerates those
+danger_slots = SlotTracker()
+
+# radar slots the upstream answered with 404, retried with a growing delay
+radar_backoff = SlotBackoff(server_config.crawler.radar_retry, server_config.crawler.radar_retry_max)
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -36,32 +67,35 @@ with open(config_path, "r") as f:
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def request_radar_data(dt: datetime.datetime):
+def request_radar_data(dt: datetime.datetime) -> Tuple[int, Union[bytes, None]]:
     """
     Request the radar data for a given datetime.
+
+    :return: the status code and the json body, None if the request wasn't successful
     """
     dts = dt.strftime("%Y%m%d_%H%M")
-    rsp = rq.request("GET",
-                     f"https://www.meteoschweiz.admin.ch/product/output/radar/rzc/radar_rzc.{dts}.json")
+    rsp = http_session.get(f"{upstream_url}/radar/rzc/radar_rzc.{dts}.json")
 
     if rsp.ok:
-        return rsp.json()
+        return rsp.status_code, rsp.content
 
-    return None
+    return rsp.status_code, None
 
 
-def request_rain_prediction_data(dt: datetime.datetime, version: datetime.datetime) -> Tuple[int, Union[dict, None]]:
+def request_rain_prediction_data(dt: datetime.datetime, version: datetime.datetime) -> Tuple[int, Union[bytes, None]]:
     """
     Request the prediction data for a given datetime and provided a specific output version
+
+    Returns the raw json body, it is decoded in a worker process.
     """
     dts = dt.strftime("%Y%m%d_%H%M")
     vss = version.strftime("%Y%m%d_%H%M")
-    url = f"https://www.meteoschweiz.admin.ch/product/output/inca/precipitation/rate/version__{vss}/rate_{dts}.json"
+    url = f"{upstream_url}/inca/precipitation/rate/version__{vss}/rate_{dts}.json"
 
-    rsp = rq.request("GET", url)
+    rsp = http_session.get(url)
 
     if rsp.ok:
-        return rsp.status_code, rsp.json()
+        return rsp.status_code, rsp.content
 
     return rsp.status_code, None
 
@@ -75,15 +109,15 @@ def request_wind_prediction_strength(dt: datetime.datetime,
     dts = dt.strftime("%Y%m%d_%H%M")
     vss = version.strftime("%Y%m%d_%H%M")
     if rt == RecordType.wind_10m:
-        url = f"https://www.meteoschweiz.admin.ch/product/output/cosmo/wind-10m/images/version__{vss}/wind-10m_{dts}.json"
+        url = f"{upstream_url}/cosmo/wind-10m/images/version__{vss}/wind-10m_{dts}.json"
     elif rt == RecordType.wind_2000m:
-        url = f"https://www.meteoschweiz.admin.ch/product/output/cosmo/wind-2000m/images/version__{vss}/wind-2000m_{dts}.json"
+        url = f"{upstream_url}/cosmo/wind-2000m/images/version__{vss}/wind-2000m_{dts}.json"
     else:
         raise ValueError("Unknown RecordType")
 
-    rsp = rq.request("GET", url)
+    rsp = http_session.get(url)
     if rsp.ok:
-        return rsp.status_code, rsp.json()
+        return rsp.status_code, serializer.loads(rsp.content)
 
     return rsp.status_code, None
 
@@ -97,13 +131,13 @@ def request_wind_direction_direction(dt: datetime.datetime,
     dts = dt.strftime("%Y%m%d_%H%M")
     vss = version.strftime("%Y%m%d_%H%M")
     if rt == RecordType.wind_10m:
-        url = f"https://www.meteoschweiz.admin.ch/product/output/cosmo/wind-10m/images/version__{vss}/wind-10m_{dts}.png"
+        url = f"{upstream_url}/cosmo/wind-10m/images/version__{vss}/wind-10m_{dts}.png"
     elif rt == RecordType.wind_2000m:
-        url = f"https://www.meteoschweiz.admin.ch/product/output/cosmo/wind-2000m/images/version__{vss}/wind-2000m_{dts}.png"
+        url = f"{upstream_url}/cosmo/wind-2000m/images/version__{vss}/wind-2000m_{dts}.png"
     else:
         raise ValueError("Unknown RecordType")
 
-    rsp = rq.request("GET", url)
+    rsp = http_session.get(url)
     if rsp.ok:
         return rsp.status_code, rsp.content
 
@@ -112,21 +146,14 @@ def request_wind_direction_direction(dt: datetime.datetime,
 
 def get_next_prediction(dt: Union[datetime.datetime, None], rt: RecordType):
     """
-    Get next prediction
+    Get next prediction (from the versions.json cached by the version watcher)
     """
-    resp = rq.get("https://www.meteoswiss.admin.ch/product/output/versions.json")
-
-    if resp.ok:
-        content = resp.json()
-        if rt == RecordType.rain:
-            target_dt = content.get("inca/precipitation/rate")
-        elif rt == RecordType.wind_10m:
-            target_dt = content.get("cosmo/wind-10m/images")
-        elif rt == RecordType.wind_2000m:
-            target_dt = content.get("cosmo/wind-2000m/images")
-        else:
-            raise ValueError("Unknown RecordType")
+    if rt not in version_keys:
+        raise ValueError("Unknown RecordType")
+
+    target_dt = version_watcher.get(version_keys[rt])
 
+    if target_dt is not None:
         new_dt = pytz.utc.localize(datetime.datetime.strptime(target_dt, "%Y%m%d_%H%M"))
         if dt is None or new_dt > dt:
             return new_dt
@@ -134,9 +161,36 @@ def get_next_prediction(dt: Union[datetime.datetime, None], rt: RecordType):
     return dt
 
 
+def decode_to_file(content: bytes, store_path: str):
+    """
+    Decode a meteoswiss json body to GeoJSON and write it (and its siblings) to the store path. Runs in the decode
+    worker pool.
+    """
+    with open(store_path, "wb") as f:
+        write_feature_collection(f, iter_geojson_features(serializer.loads(content)))
+
+    blob_store.prepare_frame(store_path)
+
+
+def remove_uncommitted(futures: List[Tuple[datetime.datetime, Future]]):
+    """
+    Remove the temp files of the frames that were decoded but not committed (i.e. because a later frame failed). Call
+    it once the pools are shut down, so no frame is still being decoded.
+
+    :param futures: (dt, future returning the temp path or None) of every frame
+    """
+    for _, future in futures:
+        if future.done() and not future.cancelled() and future.exception() is None and future.result() is not None:
+            # committed frames have been moved to the blob store already
+            precompress.remove_frame(future.result())
+
+
 def update_rain_prediction(version: datetime.datetime, update_time: datetime.datetime):
     """
     Update the prediction data
+
+    The frames are fetched concurrently (bounded by crawler.fetch_workers) and decoded in a process pool
+    (crawler.decode_workers). The records are committed in timestamp order.
     """
     next_prediction = (update_time - datetime.timedelta(minutes=update_time.minute % 5,
                                                         seconds=update_time.second,
@@ -148,39 +202,64 @@ def update_rain_prediction(version: datetime.datetime, update_time: datetime.dat
                                                        microseconds=update_time.microsecond)
                       + datetime.timedelta(days=2))
 
-    # Get the prediction for as long as they come and insert into the database
+    prediction_dts = []
     while next_prediction < end_prediction:
         assert next_prediction.minute % 5 == 0, "next_prediction is not a multiple of 5 minutes"
-        st, js = request_rain_prediction_data(next_prediction, version)
-
-        # Successful request
-        if st == 200:
-            assert js is not None, "js is None from meteoswiss prediction response"
-            store_path = os.path.join(server_config.data_home, "storage", "temp.json")
-
-            print(f"Got Prediction: {next_prediction.strftime('%Y%m%d_%H%M')}")
-
-            # Transform the MeteoData to GeoJSON
-            transformed = decode_geojson(js)
-
-            # Write to File
-            with open(store_path, "w") as f:
-                json.dump(transformed, f)
-
-            record = RainRecord(
-                dt=next_prediction,
-                type="prediction",
-                processed=True,
-                version=version
-            )
-
-            record.record_id = object_id_to_string(mdbc.insert_prediction_record(mongo, record))
-
-            os.rename(store_path, os.path.join(server_config.data_home, "storage",
-                                               f"{record.record_id}.json"))
-
+        prediction_dts.append(next_prediction)
         next_prediction += datetime.timedelta(minutes=5)
 
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=server_config.crawler.fetch_workers) as fetch_pool, \
+                ProcessPoolExecutor(max_workers=server_config.crawler.decode_workers) as decode_pool:
+
+            def fetch_and_decode(dt: datetime.datetime) -> Union[str, None]:
+                st, content = request_rain_prediction_data(dt, version)
+
+                # Unsuccessful request
+                if st != 200:
+                    return None
+
+                assert content is not None, "content is None from meteoswiss prediction response"
+                store_path = os.path.join(server_config.data_home, "storage",
+                                          f"temp_rain_{version.strftime('%Y%m%d_%H%M')}_{dt.strftime('%Y%m%d_%H%M')}"
+                                          f".json")
+
+                # Transform the MeteoData to GeoJSON and write to file
+                try:
+                    decode_pool.submit(decode_to_file, content, store_path).result()
+                except Exception:
+                    precompress.remove_frame(store_path)
+                    raise
+                return store_path
+
+            futures = [(dt, fetch_pool.submit(fetch_and_decode, dt)) for dt in prediction_dts]
+
+            # Insert into the database in timestamp order
+            try:
+                for dt, future in futures:
+                    store_path = future.result()
+                    if store_path is None:
+                        continue
+
+                    print(f"Got Prediction: {dt.strftime('%Y%m%d_%H%M')}")
+
+                    record = RainRecord(
+                        dt=dt,
+                        type="prediction",
+                        processed=True,
+                        version=version
+                    )
+
+                    record.digest = blob_store.commit_frame(store_path, "json")
+                    record.record_id = object_id_to_string(mdbc.insert_prediction_record(mongo, record))
+                    danger_slots.mark([dt])
+            finally:
+                for _, future in futures:
+                    future.cancel()
+    finally:
+        remove_uncommitted(futures)
+
     print("Done with prediction")
 
 
@@ -205,16 +284,14 @@ def update_wind_10_prediction(version: datetime.datetime, update_time: datetime.
         # Successful request
         if st == 200:
             assert js is not None, "js is None from meteoswiss prediction response"
-            store_path = os.path.join(server_config.data_home, "storage", "temp.json")
+            store_path = os.path.join(server_config.data_home, "storage", "temp_wind.json")
 
             print(f"Got Prediction Strength 10m: {next_prediction.strftime('%Y%m%d_%H%M')}")
 
-            # Transform the MeteoData to GeoJSON
-            transformed = decode_geojson(js)
-
-            # Write to File
-            with open(store_path, "w") as f:
-                json.dump(transformed, f)
+            # Transform the MeteoData to GeoJSON and stream it to the file
+            with open(store_path, "wb") as f:
+                write_feature_collection(f, iter_geojson_features(js))
+            blob_store.prepare_frame(store_path)
 
             record = WindRecord(
                 dt=next_prediction,
@@ -223,10 +300,9 @@ def update_wind_10_prediction(version: datetime.datetime, update_time: datetime.
                 version=version
             )
 
+            record.digest = blob_store.commit_frame(store_path, "json")
             record.record_id = object_id_to_string(mdbc.insert_wind_record(mongo, record))
-
-            os.rename(store_path, os.path.join(server_config.data_home, "storage",
-                                               f"{record.record_id}.json"))
+            danger_slots.mark_range(next_prediction, next_prediction + datetime.timedelta(hours=1))
 
         next_prediction += datetime.timedelta(hours=1)
 
@@ -244,7 +320,7 @@ def update_wind_10_prediction(version: datetime.datetime, update_time: datetime.
         # Successful request
         if st == 200:
             assert img_data is not None, "js is None from meteoswiss prediction response"
-            store_path = os.path.join(server_config.data_home, "storage", "temp.png")
+            store_path = os.path.join(server_config.data_home, "storage", "temp_wind.png")
 
             print(f"Got Prediction Direction 10m: {next_prediction.strftime('%Y%m%d_%H%M')}")
 
@@ -259,11 +335,9 @@ def update_wind_10_prediction(version: datetime.datetime, update_time: datetime.
                 version=version
             )
 
+            record.digest = blob_store.commit_frame(store_path, "png")
             record.record_id = object_id_to_string(mdbc.insert_wind_record(mongo, record))
 
-            os.rename(store_path, os.path.join(server_config.data_home, "storage",
-                                               f"{record.record_id}.png"))
-
         next_prediction += datetime.timedelta(hours=1)
 
     print("Done with prediction")
@@ -306,64 +380,105 @@ def crawl_wind_prediction(update_time: datetime.datetime):
     return False
 
 
-def crawl_radar(update_time: datetime.datetime):
+def crawl_radar(update_time: datetime.datetime) -> bool:
     """
     Crawl the radar data.
-    """
-    yesterday = update_time - datetime.timedelta(days=1)
-    latest_record = mdbc.get_latest_radar_record(mongo)
-    if latest_record is None:
-        latest_dt = datetime.datetime(yesterday.year,
-                                      yesterday.month,
-                                      yesterday.day,
-                                      0, 0, 0,
-                                      tzinfo=datetime.UTC)
-    else:
-        latest_dt = pytz.utc.localize(latest_record.dt)
 
-    assert type(latest_dt) is datetime.datetime, "type of last entry is not datetime"
+    Every 5 minute slot of the last 24h without a radar record is fetched, so downtimes and holes in the middle of the
+    timeline are backfilled. The missing slots come from one query, the frames are fetched concurrently (bounded by
+    crawler.fetch_workers, over the shared session) and decoded in a process pool (crawler.decode_workers). The
+    records are inserted with a single insert_many. A slot that fails is skipped and tried again with the next run.
+    Slots older than crawler.radar_publish_lag the upstream answers with 404 are holes and retried with a growing
+    delay (see SlotBackoff), recent ones are not published yet and requested again with the next run.
 
-    while latest_dt < update_time:
-        assert latest_dt.minute % 5 == 0, "latest_dt is not a multiple of 5 minutes"
-
-        data = request_radar_data(latest_dt)
-
-        # only write if we have data
-        if data is not None:
-            transformed = decode_geojson(data)
-
-            store_path = os.path.join(server_config.data_home, "storage", f"temp.json")
-
-            with open(store_path, "w") as f:
-                json.dump(transformed, f)
-
-            new_element = RainRecord(
-                dt=latest_dt,
-                type="radar",
-                processed=True
-            )
-
-            record_id = mdbc.insert_radar_record(mongo, new_element)
-            print("Got Radar for ", latest_dt)
-            os.rename(store_path, os.path.join(server_config.data_home, "storage",
-                                               f"{object_id_to_string(record_id)}.json"))
-
-        latest_dt += datetime.timedelta(minutes=5)
-
-
-def update_set_color(data: list, color: str):
+    :return: True if a radar frame was inserted
     """
-    Update the color of the data
+    first_dt = update_time - datetime.timedelta(days=1)
+    first_dt = first_dt - datetime.timedelta(minutes=first_dt.minute % 5, seconds=first_dt.second,
+                                             microseconds=first_dt.microsecond)
+    if first_dt < update_time - datetime.timedelta(days=1):
+        first_dt += datetime.timedelta(minutes=5)
+
+    existing = mdbc.get_radar_dts(mongo, first_dt, update_time)
+    radar_backoff.forget_before(first_dt)
+    published_dt = update_time - datetime.timedelta(seconds=server_config.crawler.radar_publish_lag)
+    now = time.monotonic()
+
+    missing_dts = []
+    cur_dt = first_dt
+    while cur_dt < update_time:
+        assert cur_dt.minute % 5 == 0, "cur_dt is not a multiple of 5 minutes"
+        if cur_dt not in existing and radar_backoff.due(cur_dt, now):
+            missing_dts.append(cur_dt)
+        cur_dt += datetime.timedelta(minutes=5)
+
+    if len(missing_dts) == 0:
+        return False
+
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=server_config.crawler.fetch_workers) as fetch_pool, \
+                ProcessPoolExecutor(max_workers=server_config.crawler.decode_workers) as decode_pool:
+
+            def fetch_and_decode(dt: datetime.datetime) -> Union[str, None]:
+                store_path = os.path.join(server_config.data_home, "storage",
+                                          f"temp_radar_{dt.strftime('%Y%m%d_%H%M')}.json")
+                try:
+                    st, content = request_radar_data(dt)
+
+                    # no frame for this slot, a hole unless the slot is too recent to be published
+                    if st == 404 and dt < published_dt:
+                        radar_backoff.miss(dt, time.monotonic())
+                    if content is None:
+                        return None
+
+                    # Transform the MeteoData to GeoJSON and write to file
+                    decode_pool.submit(decode_to_file, content, store_path).result()
+                    return store_path
+                except Exception as e:
+                    # one slot doesn't fail the backfill, it's tried again with the next run
+                    print(f"Failed to get radar {dt.strftime('%Y%m%d_%H%M')}: {e!r}")
+                    precompress.remove_frame(store_path)
+                    return None
+
+            futures = [(dt, fetch_pool.submit(fetch_and_decode, dt)) for dt in missing_dts]
+
+            try:
+                fetched = [(dt, future.result()) for dt, future in futures]
+            finally:
+                for _, future in futures:
+                    future.cancel()
+
+        fetched = [(dt, store_path) for dt, store_path in fetched if store_path is not None]
+        if len(fetched) == 0:
+            return False
+
+        records = [RainRecord(dt=dt, type="radar", processed=True) for dt, _ in fetched]
+        for record, digest in zip(records, blob_store.commit_frames([path for _, path in fetched], "json")):
+            record.digest = digest
+
+        mdbc.insert_radar_records(mongo, records)
+    finally:
+        remove_uncommitted(futures)
+
+    radar_backoff.clear([dt for dt, _ in fetched])
+    danger_slots.mark([dt for dt, _ in fetched])
+    print(f"Got Radar for {len(fetched)} of {len(missing_dts)} missing slots "
+          f"({fetched[0][0].strftime('%Y%m%d_%H%M')} - {fetched[-1][0].strftime('%Y%m%d_%H%M')})")
+
+    return True
+
+
+def regenerate_danger(dirty: Set[datetime.datetime] = None):
     """
-    for entry in data:
-        entry["properties"]["color"] = color
-
-    return data
+    Regenerate the danger data.
 
+    The rain records of the window and the existing danger keys are loaded with one query each. A slot is only
+    fused if no danger record exists for the (rain record, wind record) pair that currently wins it. The fusion
+    runs in a process pool (crawler.danger_workers, one job per wind record), this process keeps the database
+    bookkeeping and writes the new danger records with a single insert_many.
 
-def regenerate_danger():
-    """
-    Regenerate the danger data.
+    :param dirty: the (utc) slots to regenerate (see SlotTracker), None for every slot of the latest wind version
     """
     latest_rain = mdbc.get_rain_prediction_version(mongo)
     latest_wind = mdbc.get_wind_prediction_version(mongo)
@@ -372,6 +487,26 @@ def regenerate_danger():
     assert latest_wind is not None, "latest_wind is None"
 
     wind_records = mdbc.get_all_wind_records_of_version(mongo, latest_wind, WindRecordType.strength)
+    if dirty is not None:
+        # only the wind records valid for one of the slots
+        hours = {dt.replace(minute=0) for dt in dirty}
+        wind_records = [record for record in wind_records if pytz.utc.localize(record.dt) in hours]
+
+    if len(wind_records) == 0:
+        return
+
+    window_start = pytz.utc.localize(min(record.dt for record in wind_records))
+    window_end = pytz.utc.localize(max(record.dt for record in wind_records)) + datetime.timedelta(hours=1)
+    if dirty is not None:
+        window_start = max(window_start, min(dirty))
+        window_end = min(window_end, max(dirty) + datetime.timedelta(minutes=5))
+
+    rain_records = mdbc.get_rain_records_in_range(mongo, window_start, window_end)
+    existing = mdbc.get_danger_keys(mongo, window_start, window_end)
+
+    # (wind path, [(rain path, temp path)]) per wind record and the danger records of the temp paths
+    jobs = []
+    new_records = []
 
     # Loop over wind records
     for record in wind_records:
@@ -382,22 +517,20 @@ def regenerate_danger():
         end_time = pytz.utc.localize(record.dt) + datetime.timedelta(hours=1)
 
         # make sure the wind data exists
-        wind_path = os.path.join(server_config.data_home, "storage", f"{record.record_id}.json")
+        wind_path = os.path.join(server_config.data_home, "storage", f"{blob_store.frame_name(record)}.json")
         if not os.path.exists(wind_path):
             warnings.warn("Wind record does not exist")
             continue
 
-        with open(wind_path, "r") as f:
-            wind_data = json.load(f)
+        slots = []
 
-        wind_green = list(filter(lambda x: "cccccc" in x["properties"]["color"] or "ffffff" in x["properties"]["color"],
-                                 wind_data["features"]))
-        wind_yellow = list(filter(lambda x: "59cc00" in x["properties"]["color"], wind_data["features"]))
-        wind_red = list(filter(lambda x: "90cc00" in x["properties"]["color"], wind_data["features"]))
-
-        # Go over range and regenerate the danger data
+        # Go over range and collect the slots to regenerate
         while cur_time < end_time:
-            rain_record = mdbc.get_rain_record(mongo, cur_time)
+            if dirty is not None and cur_time not in dirty:
+                cur_time += datetime.timedelta(minutes=5)
+                continue
+
+            rain_record = rain_records.get(cur_time)
 
             # this shouldn't happen
             if rain_record is None:
@@ -405,67 +538,91 @@ def regenerate_danger():
                 cur_time += datetime.timedelta(minutes=5)
                 continue
 
-            if mdbc.danger_entry_exists(cur_time, rain_record.record_id, record.record_id, mongo):
+            if (cur_time, rain_record.record_id, record.record_id) in existing:
                 cur_time += datetime.timedelta(minutes=5)
                 continue
 
             # make sure the wind data exists
-            rain_path = os.path.join(server_config.data_home, "storage", f"{rain_record.record_id}.json")
+            rain_path = os.path.join(server_config.data_home, "storage", f"{blob_store.frame_name(rain_record)}.json")
             if not os.path.exists(rain_path):
                 warnings.warn("Rain record does not exist")
                 cur_time += datetime.timedelta(minutes=5)
                 continue
 
-            with open(rain_path, "r") as f:
-                rain_data = json.load(f)
-
-            # Extract yellow and red feature from rain
-            yellow = list(filter(lambda x: x["properties"]["color"] == "#9a7e95", rain_data["features"]))
-            red = list(filter(lambda x: x["properties"]["color"] == "#0001fc", rain_data["features"]))
-
-            # Create object for danger
-            temp_danger = {"type": "FeatureCollection", "features": []}
+            store_path = os.path.join(server_config.data_home, "storage",
+                                      f"temp_danger_{cur_time.strftime('%Y%m%d_%H%M')}.json")
+            slots.append((rain_path, store_path))
 
-            # build danger from rain and wind
-            full_green = update_set_color(copy.deepcopy(wind_green), "#00ff00")
-            yellow.extend(copy.deepcopy(wind_yellow))
-            full_yellow = update_set_color(yellow, "#ffff00")
-            red.extend(copy.deepcopy(wind_red))
-            full_red = update_set_color(red, "#ff0000")
-
-            # Fill danger object
-            temp_danger["features"] = [full_green[0]] + full_yellow + full_green[1:] + full_red
-
-            # write to disk
-            store_path = os.path.join(server_config.data_home, "storage", f"temp.json")
-            with open(store_path, "w") as f:
-                json.dump(temp_danger, f)
-
-            # Insert into database
-            dr = DangerRecord(
+            new_records.append(DangerRecord(
                 dt=cur_time,
                 wind_id=record.record_id,
                 rain_id=rain_record.record_id,
                 wind_version=record.version,
                 rain_version=rain_record.version
-            )
-
-            print("Added Danger Record for ", cur_time)
-            dr.record_id = object_id_to_string(mdbc.insert_danger_record(mongo, dr))
-            os.rename(store_path, os.path.join(server_config.data_home, "storage",
-                                               f"{dr.record_id}.json"))
+            ))
 
             cur_time += datetime.timedelta(minutes=5)
 
+        if len(slots) > 0:
+            jobs.append((wind_path, slots))
+
+    # Build the danger data
+    store_paths = [path for written in generate_danger(jobs, server_config.crawler.danger_workers) for path in written]
+
+    # Store the frames, then insert into database
+    for dr, digest in zip(new_records, blob_store.commit_frames(store_paths, "json")):
+        dr.digest = digest
+
+    record_ids = mdbc.insert_danger_records(mongo, new_records)
+
+    for dr, record_id in zip(new_records, record_ids):
+        dr.record_id = object_id_to_string(record_id)
+
+    print(f"Added {len(new_records)} Danger Records")
+
+
+def regenerate_dirty_danger():
+    """
+    Regenerate the danger data of the slots marked in danger_slots since the last run (all slots on the first run).
+    """
+    dirty = danger_slots.take()
+    if dirty is not None and len(dirty) == 0:
+        return
+
+    try:
+        regenerate_danger(dirty)
+    except Exception:
+        danger_slots.restore(dirty)
+        raise
+
+
+def build_scheduler() -> CrawlerScheduler:
+    """
+    Build the crawler scheduler. Every product runs as its own task, so radar ingest never waits behind a
+    prediction backfill. The versions.json is polled by its own task, which triggers the rain and wind predictions
+    when their version changed. The danger data is regenerated whenever new rain or wind data was ingested, only for
+    the slots it affects.
+    """
+    cc = server_config.crawler
+
+    danger = CrawlerTask("danger", regenerate_dirty_danger, interval=cc.danger.interval, timeout=cc.danger.timeout)
+    radar = CrawlerTask("radar", lambda: crawl_radar(update_time=datetime.datetime.now(datetime.UTC)),
+                        interval=cc.radar.interval, timeout=cc.radar.timeout, triggers=[danger])
+    wind = CrawlerTask("wind_prediction",
+                       lambda: crawl_wind_prediction(update_time=datetime.datetime.now(datetime.UTC)),
+                       interval=cc.wind_prediction.interval, timeout=cc.wind_prediction.timeout, triggers=[danger])
+    rain = CrawlerTask("rain_prediction",
+                       lambda: crawl_rain_prediction(update_time=datetime.datetime.now(datetime.UTC)),
+                       interval=cc.rain_prediction.interval, timeout=cc.rain_prediction.timeout, triggers=[danger])
+
+    versions = CrawlerTask("versions", lambda: len(version_watcher.poll()) > 0,
+                           interval=cc.versions.interval, timeout=cc.versions.timeout)
+    version_watcher.subscribe(version_keys[RecordType.rain], rain.trigger)
+    version_watcher.subscribe(version_keys[RecordType.wind_10m], wind.trigger)
+
+    return CrawlerScheduler([versions, radar, wind, rain, danger],
+                            stats_path=os.path.join(server_config.data_home, "crawler_stats.json"))
+
 
 if __name__ == "__main__":
-    while True:
-        update_dt = datetime.datetime.now(datetime.UTC)
-        crawl_radar(update_time=update_dt)
-        data_changed = crawl_wind_prediction(update_time=update_dt)
-        data_changed = data_changed or crawl_rain_prediction(update_time=update_dt)
-
-        if data_changed:
-            regenerate_danger()
-        print("Sleeping for 5 minutes")
-        time.sleep(300)
+    asyncio.run(build_scheduler().run())
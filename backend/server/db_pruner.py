@@ -1,17 +1,22 @@
-import datetime
 import os
 import json
 import time
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Union
+
+import bson
 
 from server.mongo_db_api import *
+from server import blob_store, precompress
 import server.mongo_db_common as mdbc
 from server.mongodb_data_models import *
 from server.config import ServerConfig
+from server.storage_reconciler import StorageReconciler
 
 
 data_home = "/home/alisot2000/Documents/02_ETH/FWE/Weather-fusion/backend/data"
-config_path = os.path.join(data_home, "server_config.json")
+# WEATHER_FUSION_CONFIG overrides the config location (i.e. for the tests)
+config_path = os.environ.get("WEATHER_FUSION_CONFIG", os.path.join(data_home, "server_config.json"))
 
 if not os.path.exists(config_path):
     raise FileNotFoundError("Please create the server_config.json file in the data folder")
@@ -22,60 +27,63 @@ with open(config_path, "r") as f:
     server_config = ServerConfig.model_validate(d)
     mongo = MongoAPI(db_address=server_config.mongo_db.address, db_name=server_config.mongo_db.database,
                      db_username=server_config.mongo_db.username, db_password=server_config.mongo_db.password)
+    mdbc.ensure_indexes(mongo)
+
+storage = os.path.join(server_config.data_home, "storage")
 
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def remove_rain(records: List[RainRecord], rain_type: str):
+def remove_records(collection: str, label: str, frames: List[Tuple[bson.ObjectId, Union[None, str], str]]):
     """
-    Remove the predictions from the records
+    Remove records with one delete_many, then remove the frames they own (records without digest, the blobs are
+    removed by the storage reconciler once unreferenced). The files are removed by a thread pool
+    (pruner.unlink_workers).
+
+    :param collection: the collection of the records
+    :param label: name of the records in the report
+    :param frames: (id, digest, extension) of every record
     """
+    start = time.perf_counter()
     db_count = 0
     file_count = 0
 
-    for entry in records:
-        p = os.path.join(server_config.data_home, "storage", f"{entry.record_id}.json")
-        if os.path.exists(p):
-            os.remove(p)
-            file_count += 1
+    if len(frames) > 0:
+        # the records go first, so no record references a removed frame
+        db_count = mongo.delete(collection=collection, filter_dict={"_id": {"$in": [f[0] for f in frames]}})
+        paths = blob_store.owned_frames(storage, [(object_id_to_string(record_id), digest, extension)
+                                                  for record_id, digest, extension in frames])
 
-        db_count += mongo.delete_one(collection="rain_data", filter_dict={"_id": string_to_object_id(entry.record_id)})
-    print(f"Deleted {db_count} {rain_type} entries from the database and {file_count} files from the storage")
+        with ThreadPoolExecutor(max_workers=server_config.pruner.unlink_workers) as pool:
+            file_count = sum(pool.map(precompress.remove_frame, paths))
 
+    elapsed = time.perf_counter() - start
+    print(f"Deleted {db_count} {label} entries from the database and {file_count} files from the storage "
+          f"in {elapsed:.2f}s ({len(frames) / max(elapsed, 1e-6):.0f} records/s)")
 
-def remove_wind(records: List[WindRecord]):
-    db_count = 0
-    file_count = 0
 
-    for entry in records:
-        if entry.type == WindRecordType.strength:
-            p = os.path.join(server_config.data_home, "storage", f"{entry.record_id}.json")
-        elif entry.type == WindRecordType.direction:
-            p = os.path.join(server_config.data_home, "storage", f"{entry.record_id}.png")
-        else:
-            raise ValueError(f"Unknown wind record type: {entry.type}")
-
-        if os.path.exists(p):
-            os.remove(p)
-            file_count += 1
-
-        db_count += mongo.delete_one(collection="wind_data", filter_dict={"_id": string_to_object_id(entry.record_id)})
-    print(f"Deleted {db_count} wind entries from the database and {file_count} files from the storage")
+def remove_rain(records: List[Tuple[bson.ObjectId, Union[None, str]]], rain_type: str):
+    """
+    Remove the predictions from the records, their blobs are removed by the storage reconciler once unreferenced
+    """
+    remove_records("rain_data", rain_type, [(record_id, digest, "json") for record_id, digest in records])
 
 
-def remove_danger(records: List[WindRecord]):
-    db_count = 0
-    file_count = 0
+def remove_wind(records: List[Tuple[bson.ObjectId, Union[None, str], WindRecordType]]):
+    frames = []
+    for record_id, digest, wt in records:
+        if wt == WindRecordType.strength:
+            frames.append((record_id, digest, "json"))
+        elif wt == WindRecordType.direction:
+            frames.append((record_id, digest, "png"))
+        else:
+            raise ValueError(f"Unknown wind record type: {wt}")
 
-    for entry in records:
-        p = os.path.join(server_config.data_home, "storage", f"{entry.record_id}.json")
+    remove_records("wind_data", "wind", frames)
 
-        if os.path.exists(p):
-            os.remove(p)
-            file_count += 1
 
-        db_count += mongo.delete_one(collection="danger_data", filter_dict={"_id": string_to_object_id(entry.record_id)})
-    print(f"Deleted {db_count} danger entries from the database and {file_count} files from the storage")
+def remove_danger(records: List[Tuple[bson.ObjectId, Union[None, str]]]):
+    remove_records("danger_data", "danger", [(record_id, digest, "json") for record_id, digest in records])
 
 
 def prune_rain_prediction():
@@ -87,37 +95,30 @@ def prune_rain_prediction():
     remove_rain(entries, "rain prediction")
 
 
-def prune_radar():
+def prune_superseded():
     """
-    Prune the radar data. -> Radar files that are older than a day
+    Prune the wind and danger records of which a newer version exists for the same time (and type)
     """
-    now = datetime.datetime.now(datetime.UTC)
-    entries = mdbc.get_outdated_radar_entries(mongo, now)
-    remove_rain(entries, "rain radar")
-
+    remove_wind(mdbc.get_superseded_wind_records(mongo))
+    remove_danger(mdbc.get_superseded_danger_records(mongo))
 
-def prune_danger():
-    """
-    Prune the danger data. -> Danger files that are older than a day
-    """
-    now = datetime.datetime.now(datetime.UTC)
-    entries = mdbc.get_outdated_danger_records(mongo, now)
-    remove_danger(entries)
 
+if __name__ == "__main__":
+    # radar, wind and danger records expire through the TTL indexes, their files are removed by the reconciler
+    mdbc.set_missing_expiry(mongo)
+    reconciler = StorageReconciler(storage, batch_size=server_config.pruner.reconcile_batch,
+                                   grace=server_config.pruner.orphan_grace)
 
-def prune_wind():
-    """
-    Remove the data from the wind and danger collections that are older than 24 hours
-    """
-    now = datetime.datetime.now(datetime.UTC)
-    entries = mdbc.get_outdated_wind_prediction_entries(mongo, now)
-    remove_wind(entries)
+    next_prediction_prune = 0.0
+    while True:
+        if time.time() >= next_prediction_prune:
+            prune_rain_prediction()
+            prune_superseded()
+            next_prediction_prune = time.time() + server_config.pruner.prediction_interval
 
+        start = time.perf_counter()
+        removed = reconciler.step(mongo)
+        if removed > 0:
+            print(f"Removed {removed} orphaned files from the storage in {time.perf_counter() - start:.2f}s")
 
-if __name__ == "__main__":
-    while True:
-        prune_radar()
-        prune_rain_prediction()
-        prune_wind()
-        prune_danger()
-        time.sleep(1800)
+        time.sleep(server_config.pruner.reconcile_interval)
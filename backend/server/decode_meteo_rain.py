@@ -1,3 +1,8 @@
+from itertools import repeat
+
+import numpy as np
+
+
 def ch_to_wgs_lng(x, y):
     lv03_95 = lv03_95_to_ch(x, y)
     i = (lv03_95['x'] - 600000) / 1e6
@@ -31,121 +36,231 @@ def calculate_orientation(coords):
     return "clockwise" if area < 0 else "counter-clockwise"
 
 
-def decode_shape_coordinates(encoded_shape, coordinates):
-    x_index = encoded_shape['i']
-    y_index = encoded_shape['j']
-
-    decoded_coordinates = []
-    char_index = 0
-
-    while char_index < len(encoded_shape['o']):
-        x = 0
-        y = 0
-
-        offset = int(encoded_shape['o'][char_index]) / 10 + 0.05
-
-        if x_index % 2 == 0:
-            x = coordinates['x_min'] + (coordinates['x_max'] - coordinates['x_min']) * (x_index / 2) / coordinates[
-                'x_count']
-            y = coordinates['y_min'] + (coordinates['y_max'] - coordinates['y_min']) * ((y_index - 1) / 2 + offset) / \
-                coordinates['y_count']
+def _python_pow(values: np.ndarray, *exponents: int) -> list:
+    """
+    Element wise powers which match python's float ** int bit for bit. (numpy's SIMD power does not)
+
+    The points lie on a grid, so there are far fewer distinct values than points.
+    """
+    unique, inverse = np.unique(values, return_inverse=True)
+    unique = unique.tolist()
+    return [np.fromiter(map(pow, unique, repeat(exponent)), dtype=np.float64, count=len(unique))[inverse]
+            for exponent in exponents]
+
+
+def lv03_95_to_ch_array(x: np.ndarray, y: np.ndarray):
+    """
+    Vectorized version of lv03_95_to_ch
+    """
+    return np.where(x >= 2000000, x - 2000000, x), np.where(y >= 1000000, y - 1000000, y)
+
+
+def ch_to_wgs_array(x: np.ndarray, y: np.ndarray):
+    """
+    Vectorized version of ch_to_wgs. Returns the longitudes and latitudes as two arrays.
+
+    The arithmetic is kept in the same order as the scalar functions so the results are identical.
+    """
+    lv_x, lv_y = lv03_95_to_ch_array(x, y)
+    i = (lv_x - 600000) / 1e6
+    r = (lv_y - 200000) / 1e6
+
+    i_2, i_3 = _python_pow(i, 2, 3)
+    r_2, r_3 = _python_pow(r, 2, 3)
+
+    o_lng = 2.6779094 + 4.728982 * i + 0.791484 * i * r + 0.1306 * i * r_2 - 0.0436 * i_3
+    o_lat = 16.9023892 + 3.238272 * r - 0.270978 * i_2 - 0.002528 * r_2 - 0.0447 * i_2 * r - 0.014 * r_3
+    return 100 * o_lng / 36, 100 * o_lat / 36
+
+
+def decode_shapes_coordinates(encoded_shapes: list, coordinates: dict) -> list:
+    """
+    Decode a batch of encoded shapes (i.e. all shapes of a frame) at once.
+
+    The 'd' and 'o' strings of all shapes are turned into index arrays and the LV95 -> WGS84 conversion runs over
+    all points in one pass. The result is identical to calling decode_shape_coordinates on every shape.
+
+    :param encoded_shapes: list of encoded shapes (dicts with 'i', 'j', 'd', 'o')
+    :param coordinates: the 'coords' entry of the meteo file
+    :return: list of decoded coordinates, one list per shape
+    """
+    lengths = np.array([len(shape['o']) for shape in encoded_shapes], dtype=np.int64)
+    total = int(lengths.sum())
+    if total == 0:
+        return [[] for _ in encoded_shapes]
+
+    # Every point gets a pair of delta chars, the first point of a shape doesn't move ('M' == 77 -> 0)
+    deltas = []
+    for shape, count in zip(encoded_shapes, lengths.tolist()):
+        if count == 0:
+            continue
+        d = shape['d'][:2 * (count - 1)]
+        deltas.append("MM" + d + "M" * (2 * (count - 1) - len(d)))
+
+    steps = (np.frombuffer("".join(deltas).encode("ascii"), dtype=np.uint8).astype(np.int64) - 77).reshape(-1, 2)
+    offsets = np.frombuffer("".join(shape['o'] for shape in encoded_shapes).encode("ascii"),
+                            dtype=np.uint8).astype(np.int64) - 48
+
+    # Cumulative sum per shape, starting at the shapes i and j index
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    non_empty = lengths > 0
+    seg_starts = starts[non_empty]
+    seg_lengths = lengths[non_empty]
+    start_x = np.array([shape['i'] for shape in encoded_shapes], dtype=np.int64)[non_empty]
+    start_y = np.array([shape['j'] for shape in encoded_shapes], dtype=np.int64)[non_empty]
+
+    cum = np.cumsum(steps, axis=0)
+    x_index = cum[:, 0] - np.repeat(cum[seg_starts, 0] - start_x, seg_lengths)
+    y_index = cum[:, 1] - np.repeat(cum[seg_starts, 1] - start_y, seg_lengths)
+
+    offset = offsets / 10 + 0.05
+    even = x_index % 2 == 0
+
+    x_min = coordinates['x_min']
+    x_max = coordinates['x_max']
+    y_min = coordinates['y_min']
+    y_max = coordinates['y_max']
+    x = np.where(even,
+                 x_min + (x_max - x_min) * (x_index / 2) / coordinates['x_count'],
+                 x_min + (x_max - x_min) * ((x_index - 1) / 2 + offset) / coordinates['x_count'])
+    y = np.where(even,
+                 y_min + (y_max - y_min) * ((y_index - 1) / 2 + offset) / coordinates['y_count'],
+                 y_min + (y_max - y_min) * (y_index / 2) / coordinates['y_count'])
+
+    lng, lat = ch_to_wgs_array(1e3 * x, 1e3 * y)
+
+    # Shapes need to be closed if the first and the last coordinate differ
+    ends = seg_starts + seg_lengths - 1
+    needs_closing = (seg_lengths > 1) & ((lng[seg_starts] != lng[ends]) | (lat[seg_starts] != lat[ends]))
+
+    # Terms of the shoelace formula, the last point of a shape pairs with the first one (only used if closed)
+    following = np.arange(1, total + 1)
+    following[ends] = seg_starts
+    terms = (lng * lat[following] - lng[following] * lat).tolist()
+
+    points = np.column_stack((lng, lat)).tolist()
+
+    result = []
+    segments = iter(zip(seg_starts.tolist(), ends.tolist(), needs_closing.tolist()))
+    for count in lengths.tolist():
+        if count == 0:
+            result.append([])
+            continue
+
+        start, end, closing = next(segments)
+
+        # Ensure that four or more coordinates are used for each Polygon
+        if count + closing < 4:
+            result.append([])
+            continue
+
+        decoded_coordinates = points[start:end + 1]
+        if closing:
+            decoded_coordinates.append(decoded_coordinates[0])
+            area = sum(terms[start:end + 1])
         else:
-            x = coordinates['x_min'] + (coordinates['x_max'] - coordinates['x_min']) * ((x_index - 1) / 2 + offset) / \
-                coordinates['x_count']
-            y = coordinates['y_min'] + (coordinates['y_max'] - coordinates['y_min']) * (y_index / 2) / coordinates[
-                'y_count']
+            area = sum(terms[start:end])
 
-        latitude, longitude = ch_to_wgs(1e3 * x, 1e3 * y)  # You need to implement the ch_to_wgs function
-        decoded_coordinates.append([latitude, longitude])
+        # Ensure that the orientation is counter-clockwise
+        if area < 0:
+            decoded_coordinates.reverse()
 
-        if 2 * char_index < len(encoded_shape['d']):
-            x_index += ord(encoded_shape['d'][2 * char_index]) - 77
-            y_index += ord(encoded_shape['d'][2 * char_index + 1]) - 77
+        result.append(decoded_coordinates)
 
-        char_index += 1
+    return result
 
-    # Ensure that the first and last coordinates are the same for each LinearRing
-    if len(decoded_coordinates) > 1 and decoded_coordinates[0] != decoded_coordinates[-1]:
-        decoded_coordinates.append(decoded_coordinates[0])
 
-    # Ensure that the orientation is counter-clockwise
-    if calculate_orientation(decoded_coordinates) == "clockwise":
-        decoded_coordinates.reverse()
+def decode_shape_coordinates(encoded_shape, coordinates):
+    return decode_shapes_coordinates([encoded_shape], coordinates)[0]
 
-    # Ensure that four or more coordinates are used for each Polygon
-    if len(decoded_coordinates) < 4:
-        decoded_coordinates = []
 
-    return decoded_coordinates
+def iter_geojson_features(input_file: dict, batch_points: int = 50000):
+    """
+    Decode a meteo swiss contour file into GeoJSON features, yielded one by one.
 
+    Shapes are bucketed by their level 'l' in a single pass over the areas and every shape is decoded exactly once.
+    The features are ordered by level, then by the order of the areas and shapes in the file. The shapes are decoded
+    in batches of about batch_points points (MultiPolygons: per level), so only one batch is held in memory.
 
-def decode_geojson(input_file: dict):
-    t = 0
-    features = []
-    i = False
+    :param input_file: the meteo swiss json
+    :param batch_points: number of points to decode at once
+    """
+    coords = input_file['coords']
 
     if len(input_file['areas']) > 0 and any(len(shape) > 1 for shape in input_file['areas'][0]['shapes']):
-        while True:
-            i = -1
-            r = [
-                {
+        # level -> list of (area, shape); the level of a shape is the level of its outer ring
+        levels = {}
+        for area in input_file['areas']:
+            for shape in area['shapes']:
+                levels.setdefault(shape[0]['l'], []).append((area, shape))
+
+        for t in sorted(lv for lv in levels if lv >= 0):
+            encoded_shapes = [a_item for _, shape in levels[t] for a_item in shape]
+            decoded = iter(decode_shapes_coordinates(encoded_shapes, coords))
+
+            # id(area) -> (area, polygons), keeps the order of the areas
+            polygons = {}
+            for area, shape in levels[t]:
+                rings = [ring for ring in (next(decoded) for _ in shape) if len(ring) > 0]
+                polygons.setdefault(id(area), (area, []))[1].append(rings)
+
+            for area, area_polygons in polygons.values():
+                yield {
                     'type': "Feature",
                     'properties': {'color': "#" + area['color']},
                     'geometry': {
                         'type': "MultiPolygon",
-                        'coordinates': [decode_shape_coordinates(shape, input_file['coords']) for shape in area['shapes'] if
-                                        shape[0]['l'] == t]
+                        'coordinates': area_polygons
                     }
                 }
-                for area in input_file['areas'] if (r := [
-                    decode_shape_coordinates(shape, input_file['coords'])
-                    for shape in area['shapes']
-                    if shape[0]['l'] == t
-                ]) and len(r) > 0
-            ]
-
-            if len(r) == 0:
-                break
-
-            features.extend(r)
-
-            if i == -1:
-                break
-
-            t = i
     else:
-        while True:
-            i = -1
-            r = "ffffff"
-            o = []
-
-            for area in input_file['areas']:
-                for a in area['shapes']:
-                    for c, a_item in enumerate(a):
-                        if a_item['l'] == t:
-                            t_result = decode_shape_coordinates(a_item, input_file['coords'])
-                            if t_result is not None and len(t_result) > 0:
-                                o.append({
-                                    'type': "Feature",
-                                    'properties': {'color': "#" + area['color'] if c == 0 else r},
-                                    'geometry': {
-                                        'type': "Polygon",
-                                        'coordinates': [t_result]
-                                    }
-                                })
-                        elif a_item['l'] > t and (i == -1 or a_item['l'] < i):
-                            i = a_item['l']
-
-            features.extend(o)
-
-            if i == -1:
-                break
-
-            t = i
+        # level -> list of (color, encoded shape), holes (c > 0) are white
+        levels = {}
+        for area in input_file['areas']:
+            for a in area['shapes']:
+                for c, a_item in enumerate(a):
+                    levels.setdefault(a_item['l'], []).append(("#" + area['color'] if c == 0 else "ffffff", a_item))
+
+        batch = []
+        points = 0
+        for t in sorted(lv for lv in levels if lv >= 0):
+            for entry in levels[t]:
+                batch.append(entry)
+                points += len(entry[1]['o'])
+                if points >= batch_points:
+                    yield from _polygon_features(batch, coords)
+                    batch = []
+                    points = 0
+
+        yield from _polygon_features(batch, coords)
+
+
+def _polygon_features(batch: list, coords: dict):
+    """
+    Decode a batch of (color, encoded shape) and yield the non-empty Polygon features.
+    """
+    decoded = decode_shapes_coordinates([a_item for _, a_item in batch], coords)
+
+    for (color, _), t_result in zip(batch, decoded):
+        if len(t_result) > 0:
+            yield {
+                'type': "Feature",
+                'properties': {'color': color},
+                'geometry': {
+                    'type': "Polygon",
+                    'coordinates': [t_result]
+                }
+            }
 
+
+def decode_geojson(input_file: dict):
+    """
+    Decode a meteo swiss contour file into a GeoJSON FeatureCollection. (see iter_geojson_features, use it with
+    write_feature_collection to stream the output instead of holding it in memory)
+    """
     return {
         'type': "FeatureCollection",
-        'features': features
+        'features': list(iter_geojson_features(input_file))
     }
 
 
@@ -0,0 +1,154 @@
+"""
+Compact binary format (wfb) of the stored GeoJSON frames.
+
+The coordinates are quantized to 1/scale degree (1e-4 deg, ~10 m, the source grids are 1 km) and delta encoded over
+the whole frame, the structure is stored as count arrays. Layout (little endian):
+
+    header  4s magic, uint32 scale, uint32 features, uint32 polygons, uint32 rings, uint32 points,
+            uint32 length of the properties json
+    body    deflate of:
+            properties   compact json list with the properties of every feature
+            uint8        geometry type per feature (0 Polygon, 1 MultiPolygon)
+            uint32       polygon count per feature
+            uint32       ring count per polygon
+            uint32       point count per ring
+            int32        x (lng) deltas of all points, then y (lat) deltas of all points
+"""
+import struct
+import zlib
+from typing import List
+
+import numpy as np
+
+from server import serializer
+
+magic = b"WFB1"
+media_type = "application/x-wfb"
+# pseudo content-coding under which the api and precompress handle the binary sibling
+encoding = "wfb"
+suffix = ".wfb"
+default_scale = 10000
+
+geometry_types = ["Polygon", "MultiPolygon"]
+header = struct.Struct("<4sIIIIII")
+
+
+def encode_features(features: List[dict], scale: int = default_scale) -> bytes:
+    """
+    Encode the features of a FeatureCollection.
+
+    :param features: the features, Polygon or MultiPolygon geometries
+    :param scale: coordinates are stored as round(coordinate * scale)
+    :return: the wfb bytes
+    """
+    geometry_codes = []
+    polygon_counts = []
+    ring_counts = []
+    point_counts = []
+    coordinates = []
+    properties = []
+
+    for feature in features:
+        geometry = feature["geometry"]
+        polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+
+        geometry_codes.append(geometry_types.index(geometry["type"]))
+        polygon_counts.append(len(polygons))
+        for polygon in polygons:
+            ring_counts.append(len(polygon))
+            for ring in polygon:
+                point_counts.append(len(ring))
+                coordinates.extend(ring)
+
+        properties.append(feature["properties"])
+
+    points = np.round(np.array(coordinates, dtype=np.float64).reshape(-1, 2) * scale).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).astype("<i4")
+
+    properties_json = serializer.dumps(properties)
+    body = b"".join([
+        properties_json,
+        np.array(geometry_codes, dtype="<u1").tobytes(),
+        np.array(polygon_counts, dtype="<u4").tobytes(),
+        np.array(ring_counts, dtype="<u4").tobytes(),
+        np.array(point_counts, dtype="<u4").tobytes(),
+        deltas.T.tobytes(),
+    ])
+
+    return header.pack(magic, scale, len(properties), len(ring_counts), len(point_counts), len(points),
+                       len(properties_json)) + zlib.compress(body, 6)
+
+
+def decode_frame(data: bytes) -> dict:
+    """
+    Decode wfb bytes to a GeoJSON FeatureCollection (coordinates rounded to 1/scale).
+    """
+    tag, scale, n_features, n_polygons, n_rings, n_points, properties_length = header.unpack_from(data)
+    if tag != magic:
+        raise ValueError("Not a wfb frame")
+
+    body = zlib.decompress(data[header.size:])
+    properties = serializer.loads(body[:properties_length])
+    offset = properties_length
+
+    def take(dtype: str, count: int) -> np.ndarray:
+        nonlocal offset
+        array = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    geometry_codes = take("<u1", n_features).tolist()
+    polygon_counts = take("<u4", n_features).tolist()
+    ring_counts = take("<u4", n_polygons).tolist()
+    point_counts = take("<u4", n_rings).tolist()
+    deltas = take("<i4", 2 * n_points).reshape(2, n_points)
+
+    x = (np.cumsum(deltas[0], dtype=np.int64) / scale).tolist()
+    y = (np.cumsum(deltas[1], dtype=np.int64) / scale).tolist()
+    points = [list(point) for point in zip(x, y)]
+
+    features = []
+    point_index = 0
+    ring_index = 0
+    polygon_index = 0
+    for code, polygon_count, feature_properties in zip(geometry_codes, polygon_counts, properties):
+        polygons = []
+        for ring_count in ring_counts[polygon_index:polygon_index + polygon_count]:
+            rings = []
+            for point_count in point_counts[ring_index:ring_index + ring_count]:
+                rings.append(points[point_index:point_index + point_count])
+                point_index += point_count
+            ring_index += ring_count
+            polygons.append(rings)
+        polygon_index += polygon_count
+
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": geometry_types[code], "coordinates": polygons[0] if code == 0 else polygons},
+            "properties": feature_properties,
+        })
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+def accepts(accept: str) -> bool:
+    """
+    Check if an Accept header explicitly asks for wfb (wildcards don't count).
+    """
+    if not accept:
+        return False
+
+    for part in accept.split(","):
+        media, _, params = part.strip().partition(";")
+        if media.strip().lower() != media_type:
+            continue
+
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+
+    return False
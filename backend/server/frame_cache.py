@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Tuple, Union
+
+
+class FrameCache:
+    max_bytes: int
+
+    def __init__(self, max_bytes: int):
+        """
+        LRU cache of served frames (resolved record + file bytes), bounded by the total size of the file bytes.
+
+        :param max_bytes: maximum number of bytes held by the cache
+        """
+        self.max_bytes = max_bytes
+        self.generation = None
+
+        self._entries: "OrderedDict[Hashable, Tuple[Any, bytes]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Union[None, Tuple[Any, bytes]]:
+        """
+        Get the record and data of a key, None if it's not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, record: Any, data: bytes):
+        """
+        Add an entry and evict the least recently used ones until the cache fits into max_bytes.
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+
+            self._entries[key] = (record, data)
+            self._size += len(data)
+
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def validate(self, generation: Hashable):
+        """
+        Drop all entries if the generation (i.e. the current prediction versions) changed.
+        """
+        with self._lock:
+            if generation == self.generation:
+                return
+
+            if self.generation is not None:
+                self.invalidations += 1
+            self.generation = generation
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
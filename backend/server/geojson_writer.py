@@ -0,0 +1,31 @@
+from typing import IO, Iterable
+
+from server import serializer
+
+
+def write_serialized_features(f: IO[bytes], features: Iterable[bytes]):
+    """
+    Write a FeatureCollection from already serialized features, one feature at a time.
+
+    The output is the same as serializer.dump({"type": "FeatureCollection", "features": [...]}, f).
+
+    :param f: file opened in binary mode
+    :param features: the serialized features
+    """
+    f.write(b'{"type":"FeatureCollection","features":[')
+    separator = b""
+    for feature in features:
+        f.write(separator)
+        f.write(feature)
+        separator = b","
+    f.write(b"]}")
+
+
+def write_feature_collection(f: IO[bytes], features: Iterable[dict]):
+    """
+    Stream a FeatureCollection to a file, the features are serialized as they are produced (i.e. by a generator).
+
+    :param f: file opened in binary mode
+    :param features: the features
+    """
+    write_serialized_features(f, (serializer.dumps(feature) for feature in features))
@@ -175,15 +175,27 @@ class MongoAPI:
         col = self.client[self.db_name][collection]
         return col.count_documents(filter=filter_dict)
 
-    def aggregate(self, collection: str, pipeline: list = None):
+    def create_index(self, collection: str, keys: list, **kwargs):
+        """
+        Create an index on this collection if it doesn't exist yet.
+        :param collection: Collection name string
+        :param keys: A list of (key, direction) pairs specifying the index
+        :param kwargs: Passed to create_index (i.e. name, unique, expireAfterSeconds)
+        :return: name of the index
+        """
+        col = self.client[self.db_name][collection]
+        return col.create_index(keys, **kwargs)
+
+    def aggregate(self, collection: str, pipeline: list = None, **kwargs):
         """
         Perform an aggregation using the aggregation framework on this collection.
         :param collection: Collection name string
         :param pipeline: A list of aggregation pipeline stages
+        :param kwargs: Passed to aggregate (i.e. allowDiskUse)
         :return:
         """
         if pipeline is None:
             pipeline = []
 
         col = self.client[self.db_name][collection]
-        return col.aggregate(pipeline=pipeline)
+        return col.aggregate(pipeline=pipeline, **kwargs)
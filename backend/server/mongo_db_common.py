@@ -1,6 +1,6 @@
 import datetime
 import bson
-from typing import Union, List
+from typing import Union, List, Dict, Set, Tuple
 
 import pytz
 
@@ -8,6 +8,71 @@ from server.mongodb_data_models import *
 from server.mongo_db_api import MongoAPI, string_to_object_id, object_id_to_string
 
 
+# Compound indexes matching the query shapes of this module (collection -> list of indexes)
+indexes = {
+    "rain_data": [
+        # get_latest_radar_record, get_radar_dts, get_rain_record, get_rain_records_in_range
+        [("type", 1), ("dt", 1), ("version", -1)],
+        # get_rain_prediction_version, get_outdated_rain_prediction_entries
+        [("type", 1), ("version", -1)],
+        # get_referenced_names
+        [("digest", 1)],
+    ],
+    "wind_data": [
+        # get_wind_speed, get_wind_direction, get_superseded_wind_records
+        [("type", 1), ("dt", 1), ("version", -1)],
+        # get_wind_prediction_version, get_all_wind_records_of_version
+        [("version", -1), ("type", 1)],
+        # get_referenced_names
+        [("digest", 1)],
+    ],
+    "danger_data": [
+        # danger_entry_exists
+        [("dt", 1), ("rain_id", 1), ("wind_id", 1)],
+        # get_danger_record, get_danger_records_in_range, get_superseded_danger_records
+        [("dt", 1), ("rain_version", -1), ("wind_version", -1)],
+        # get_referenced_names
+        [("digest", 1)],
+    ],
+}
+
+# Records with an expires_at are removed by mongodb once it has passed (TTL index, checked about once a minute).
+# expires_at is set at insert time: radar records expire a day after their dt, wind and danger records at the end of
+# the period they are valid for. Rain predictions expire when a newer version exists, they have no expires_at and are
+# pruned by db_pruner.
+ttl_collections = ["rain_data", "wind_data", "danger_data"]
+radar_retention = datetime.timedelta(days=1)
+wind_retention = datetime.timedelta(hours=1)
+danger_retention = datetime.timedelta(minutes=5)
+
+
+def ensure_indexes(mongo: MongoAPI):
+    """
+    Create the indexes used by the queries of this module. Run at startup, existing indexes are left untouched.
+    """
+    for collection, collection_indexes in indexes.items():
+        for keys in collection_indexes:
+            mongo.create_index(collection=collection, keys=keys)
+
+    for collection in ttl_collections:
+        mongo.create_index(collection=collection, keys=[("expires_at", 1)], expireAfterSeconds=0)
+
+
+def set_missing_expiry(mongo: MongoAPI):
+    """
+    Set the expires_at of the records inserted before it existed (one update per collection).
+    """
+    def expiry(retention: datetime.timedelta) -> list:
+        return [{"$set": {"expires_at": {"$add": ["$dt", int(retention.total_seconds() * 1000)]}}}]
+
+    mongo.update(collection="rain_data", filter_dict={"type": "radar", "expires_at": {"$exists": False}},
+                 update_dict=expiry(radar_retention))
+    mongo.update(collection="wind_data", filter_dict={"expires_at": {"$exists": False}},
+                 update_dict=expiry(wind_retention))
+    mongo.update(collection="danger_data", filter_dict={"expires_at": {"$exists": False}},
+                 update_dict=expiry(danger_retention))
+
+
 def get_latest_radar_record(mongo: MongoAPI) -> Union[RainRecord, None]:
     """
     Get the latest radar record from the database.
@@ -48,6 +113,7 @@ def insert_wind_record(mongo: MongoAPI, record: WindRecord) -> bson.objectid:
     """
     dtc = record.model_dump()
     del dtc["record_id"]
+    dtc["expires_at"] = record.dt + wind_retention
 
     return mongo.insert_one(collection="wind_data", document_dict=dtc)
 
@@ -58,38 +124,49 @@ def insert_radar_record(mongo: MongoAPI, record: RainRecord) -> bson.ObjectId:
     """
     dtc = record.model_dump()
     del dtc["record_id"]
+    dtc["expires_at"] = record.dt + radar_retention
 
     return mongo.insert_one(collection="rain_data", document_dict=dtc)
 
 
-def insert_prediction_record(mongo: MongoAPI, record: RainRecord) -> bson.ObjectId:
+def insert_radar_records(mongo: MongoAPI, records: List[RainRecord]) -> List[bson.ObjectId]:
     """
-    Insert a radar record into the database.
+    Insert many radar records into the database with one insert_many.
     """
-    dtc = record.model_dump()
-    del dtc["record_id"]
+    documents = []
+    for record in records:
+        dtc = record.model_dump()
+        del dtc["record_id"]
+        dtc["expires_at"] = record.dt + radar_retention
+        documents.append(dtc)
 
-    return mongo.insert_one(collection="rain_data", document_dict=dtc)
+    res = mongo.insert(collection="rain_data", document_list=documents)
+    return res if res is not None else []
 
 
-def get_outdated_radar_entries(mongo: MongoAPI, now: datetime.datetime) -> List[RainRecord]:
+def get_radar_dts(mongo: MongoAPI, start: datetime.datetime, end: datetime.datetime) -> Set[datetime.datetime]:
     """
-    Get all outdated radar entries.
+    Get the (utc localized) dts of the radar records in [start, end) with one query (covered by the index).
     """
-    cutoff = now - datetime.timedelta(days=1)
-    records = mongo.find(collection="rain_data", filter_dict={"$and": [{"type": "radar"}, {"dt": {"$lt": cutoff}}]})
-    res = []
+    records = mongo.find(collection="rain_data", filter_dict={"type": "radar", "dt": {"$gte": start, "$lt": end}},
+                         projection_dict={"_id": 0, "dt": 1})
 
-    for record in records:
-        record["_id"] = object_id_to_string(record["_id"])
-        res.append(RainRecord(**record))
+    return {pytz.utc.localize(record["dt"]) for record in records}
 
-    return res
+
+def insert_prediction_record(mongo: MongoAPI, record: RainRecord) -> bson.ObjectId:
+    """
+    Insert a radar record into the database.
+    """
+    dtc = record.model_dump()
+    del dtc["record_id"]
+
+    return mongo.insert_one(collection="rain_data", document_dict=dtc)
 
 
-def get_outdated_rain_prediction_entries(mongo: MongoAPI) -> List[RainRecord]:
+def get_outdated_rain_prediction_entries(mongo: MongoAPI) -> List[Tuple[bson.ObjectId, Union[None, str]]]:
     """
-    Get all outdated prediction entries. (the ones who's version is no longer the newest)
+    Get the (id, digest) of all outdated prediction entries. (the ones who's version is no longer the newest)
     """
     newest_prediction = mongo.find_one(collection="rain_data", filter_dict={"type": "prediction"},
                                        sort={"version": -1})
@@ -99,28 +176,10 @@ def get_outdated_rain_prediction_entries(mongo: MongoAPI) -> List[RainRecord]:
 
     current_version = newest_prediction["version"]
     records = mongo.find(collection="rain_data", filter_dict={"$and": [{"type": "prediction"},
-                                                                       {"version": {"$ne": current_version}}]})
-    res = []
-    for record in records:
-        record["_id"] = object_id_to_string(record["_id"])
-        res.append(RainRecord(**record))
-
-    return res
-
-
-def get_outdated_wind_prediction_entries(mongo: MongoAPI, now) -> List[WindRecord]:
-    """
-    Get the outdated wind records and return them (only based on the datetime of the record - not version)
-    """
-    # TODO can be improved to only retain one entry per time. (only the newest version)
-    records = mongo.find(collection="wind_data", filter_dict={"dt": {"$lt": now}})
-
-    res = []
-    for record in records:
-        record["_id"] = object_id_to_string(record["_id"])
-        res.append(WindRecord(**record))
+                                                                       {"version": {"$ne": current_version}}]},
+                         projection_dict={"_id": 1, "digest": 1})
 
-    return res
+    return [(record["_id"], record.get("digest")) for record in records]
 
 
 def get_rain_record(mongo: MongoAPI, dt: datetime) -> Union[RainRecord, None]:
@@ -156,6 +215,35 @@ def get_rain_record(mongo: MongoAPI, dt: datetime) -> Union[RainRecord, None]:
     return None
 
 
+def get_rain_records_in_range(mongo: MongoAPI, start: datetime.datetime,
+                              end: datetime.datetime) -> Dict[datetime.datetime, RainRecord]:
+    """
+    Get the rain record of every 5 minute slot in [start, end) with one query. Per slot the record is chosen like in
+    get_rain_record (newest prediction version, radar if there is no prediction).
+
+    :return: dict from the (utc localized) dt to the record
+    """
+    records = mongo.find(collection="rain_data", filter_dict={
+        "$and": [
+            {"dt": {"$gte": start, "$lt": end}},
+            {"$or": [{"type": "radar"}, {"$and": [{"type": "prediction"}, {"version": {"$ne": None}}]}]}
+        ]
+    })
+
+    res = {}
+    for record in records:
+        record["_id"] = object_id_to_string(record["_id"])
+        rr = RainRecord(**record)
+        dt = pytz.utc.localize(rr.dt)
+
+        current = res.get(dt)
+        if current is None or ((rr.version is not None, rr.version or datetime.datetime.min)
+                               > (current.version is not None, current.version or datetime.datetime.min)):
+            res[dt] = rr
+
+    return res
+
+
 def get_wind_speed(mongo: MongoAPI, dt: datetime):
     """
     Get the wind speed record from the database.
@@ -212,10 +300,40 @@ def insert_danger_record(mongo: MongoAPI, record: DangerRecord) -> bson.ObjectId
     del dtc["record_id"]
     dtc["rain_id"] = string_to_object_id(dtc["rain_id"])
     dtc["wind_id"] = string_to_object_id(dtc["wind_id"])
+    dtc["expires_at"] = record.dt + danger_retention
 
     return mongo.insert_one(collection="danger_data", document_dict=dtc)
 
 
+def insert_danger_records(mongo: MongoAPI, records: List[DangerRecord]) -> List[bson.ObjectId]:
+    """
+    Insert many danger records into the database with one insert_many.
+    """
+    documents = []
+    for record in records:
+        dtc = record.model_dump()
+        del dtc["record_id"]
+        dtc["rain_id"] = string_to_object_id(dtc["rain_id"])
+        dtc["wind_id"] = string_to_object_id(dtc["wind_id"])
+        dtc["expires_at"] = record.dt + danger_retention
+        documents.append(dtc)
+
+    res = mongo.insert(collection="danger_data", document_list=documents)
+    return res if res is not None else []
+
+
+def get_danger_keys(mongo: MongoAPI, start: datetime.datetime,
+                    end: datetime.datetime) -> Set[Tuple[datetime.datetime, str, str]]:
+    """
+    Get the (utc localized dt, rain_id, wind_id) of all danger records in [start, end) with one query.
+    """
+    records = mongo.find(collection="danger_data", filter_dict={"dt": {"$gte": start, "$lt": end}},
+                         projection_dict={"_id": 0, "dt": 1, "rain_id": 1, "wind_id": 1})
+
+    return {(pytz.utc.localize(record["dt"]), object_id_to_string(record["rain_id"]),
+             object_id_to_string(record["wind_id"])) for record in records}
+
+
 def get_danger_record(mongo: MongoAPI, dt: datetime.datetime) -> Union[DangerRecord, None]:
     """
     Get a danger record from the database.
@@ -233,23 +351,78 @@ def get_danger_record(mongo: MongoAPI, dt: datetime.datetime) -> Union[DangerRec
     return None
 
 
-def get_outdated_danger_records(mongo: MongoAPI, now: datetime.datetime):
+def get_danger_records_in_range(mongo: MongoAPI, start: datetime.datetime,
+                                end: datetime.datetime) -> Dict[datetime.datetime, DangerRecord]:
     """
-    Get all outdated danger records.
+    Get the danger record of every 5 minute slot in [start, end) with one query. Per slot the record is chosen like
+    in get_danger_record (newest rain version, then newest wind version).
+
+    :return: dict from the (utc localized) dt to the record
     """
-    # TODO can be improved to only retain one entry per time. (only the newest version)
-    records = mongo.find(collection="danger_data", filter_dict={"dt": {"$lt": now}})
+    records = mongo.find(collection="danger_data", filter_dict={"dt": {"$gte": start, "$lt": end}})
 
-    res = []
+    def rank(record: DangerRecord):
+        return (record.rain_version is not None, record.rain_version or datetime.datetime.min,
+                record.wind_version is not None, record.wind_version or datetime.datetime.min)
+
+    res = {}
     for record in records:
         record["_id"] = object_id_to_string(record["_id"])
         record["rain_id"] = object_id_to_string(record["rain_id"])
         record["wind_id"] = object_id_to_string(record["wind_id"])
-        res.append(DangerRecord(**record))
+        dr = DangerRecord(**record)
+        dt = pytz.utc.localize(dr.dt)
+
+        current = res.get(dt)
+        if current is None or rank(dr) > rank(current):
+            res[dt] = dr
 
     return res
 
 
+def _superseded_pipeline(sort: dict, group: Union[str, dict], fields: List[str]) -> list:
+    """
+    Aggregation pipeline yielding every record but the first one of each group, in the order of sort.
+
+    :param sort: the order within the groups (newest first), should match an index. The groups hold every record of
+        the collection, run it with allowDiskUse (the $group stage is limited to 100MB of memory otherwise)
+    :param group: the group key
+    :param fields: the fields of the records returned (besides _id)
+    """
+    return [
+        {"$sort": sort},
+        {"$group": {"_id": group, "newest": {"$first": "$_id"}, "count": {"$sum": 1},
+                    "records": {"$push": {"_id": "$_id", **{f: f"${f}" for f in fields}}}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$unwind": "$records"},
+        {"$match": {"$expr": {"$ne": ["$records._id", "$newest"]}}},
+        {"$replaceRoot": {"newRoot": "$records"}},
+    ]
+
+
+def get_superseded_wind_records(mongo: MongoAPI) -> List[Tuple[bson.ObjectId, Union[None, str], WindRecordType]]:
+    """
+    Get the (id, digest, type) of the wind records of which a newer version exists for the same (type, dt), with one
+    aggregation.
+    """
+    records = mongo.aggregate(collection="wind_data", pipeline=_superseded_pipeline(
+        sort={"type": 1, "dt": 1, "version": -1}, group={"type": "$type", "dt": "$dt"}, fields=["digest", "type"]),
+        allowDiskUse=True)
+
+    return [(record["_id"], record.get("digest"), WindRecordType(record["type"])) for record in records]
+
+
+def get_superseded_danger_records(mongo: MongoAPI) -> List[Tuple[bson.ObjectId, Union[None, str]]]:
+    """
+    Get the (id, digest) of the danger records that aren't the newest of their dt (ranked like in get_danger_record),
+    with one aggregation.
+    """
+    records = mongo.aggregate(collection="danger_data", pipeline=_superseded_pipeline(
+        sort={"dt": 1, "rain_version": -1, "wind_version": -1}, group="$dt", fields=["digest"]), allowDiskUse=True)
+
+    return [(record["_id"], record.get("digest")) for record in records]
+
+
 def danger_entry_exists(dt: datetime.datetime, rain_id: str, wind_id: str, mongo: MongoAPI) -> bool:
     """
     Check if a danger entry exists.
@@ -259,3 +432,71 @@ def danger_entry_exists(dt: datetime.datetime, rain_id: str, wind_id: str, mongo
                                                                          {"wind_id": string_to_object_id(wind_id)}]})
 
     return res is not None
+
+
+def _since_filter(since: Union[None, bson.ObjectId]) -> dict:
+    return {} if since is None else {"_id": {"$gt": since}}
+
+
+def get_rain_records_since(mongo: MongoAPI, since: Union[None, bson.ObjectId]) -> List[RainRecord]:
+    """
+    Get all rain records inserted after the given id (all records if since is None), ordered by insertion.
+    """
+    records = mongo.find(collection="rain_data", filter_dict=_since_filter(since), sort=[("_id", 1)])
+
+    res = []
+    for record in records:
+        record["_id"] = object_id_to_string(record["_id"])
+        res.append(RainRecord(**record))
+
+    return res
+
+
+def get_wind_records_since(mongo: MongoAPI, since: Union[None, bson.ObjectId]) -> List[WindRecord]:
+    """
+    Get all wind records inserted after the given id (all records if since is None), ordered by insertion.
+    """
+    records = mongo.find(collection="wind_data", filter_dict=_since_filter(since), sort=[("_id", 1)])
+
+    res = []
+    for record in records:
+        record["_id"] = object_id_to_string(record["_id"])
+        res.append(WindRecord(**record))
+
+    return res
+
+
+def get_danger_records_since(mongo: MongoAPI, since: Union[None, bson.ObjectId]) -> List[DangerRecord]:
+    """
+    Get all danger records inserted after the given id (all records if since is None), ordered by insertion.
+    """
+    records = mongo.find(collection="danger_data", filter_dict=_since_filter(since), sort=[("_id", 1)])
+
+    res = []
+    for record in records:
+        record["_id"] = object_id_to_string(record["_id"])
+        record["rain_id"] = object_id_to_string(record["rain_id"])
+        record["wind_id"] = object_id_to_string(record["wind_id"])
+        res.append(DangerRecord(**record))
+
+    return res
+
+
+def get_referenced_names(mongo: MongoAPI, names: List[str]) -> Set[str]:
+    """
+    Get the names of stored frames (digests or, for records without digest, record ids) that are referenced by a
+    record, with one query per collection.
+    """
+    record_ids = [string_to_object_id(name) for name in names if bson.ObjectId.is_valid(name)]
+
+    referenced = set()
+    for collection in ["rain_data", "wind_data", "danger_data"]:
+        records = mongo.find(collection=collection, filter_dict={"$or": [{"digest": {"$in": names}},
+                                                                         {"_id": {"$in": record_ids}}]},
+                             projection_dict={"_id": 1, "digest": 1})
+        for record in records:
+            referenced.add(object_id_to_string(record["_id"]))
+            if record.get("digest") is not None:
+                referenced.add(record["digest"])
+
+    return referenced
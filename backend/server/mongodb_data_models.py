@@ -26,6 +26,7 @@ class RainRecord(BaseModel):
     type: RainRecordType
     version: Union[None, datetime.datetime] = None
     processed: bool = False
+    digest: Union[None, str] = None
 
 
 class WindRecord(BaseModel):
@@ -34,6 +35,7 @@ class WindRecord(BaseModel):
     type: WindRecordType
     version: Union[None, datetime.datetime] = None
     processed: bool = False
+    digest: Union[None, str] = None
 
 
 class DangerRecord(BaseModel):
@@ -43,3 +45,4 @@ class DangerRecord(BaseModel):
     rain_id: str = None
     wind_version: Union[None, datetime.datetime] = None
     rain_version: Union[None, datetime.datetime] = None
+    digest: Union[None, str] = None
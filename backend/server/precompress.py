@@ -0,0 +1,210 @@
+"""
+Precompressed siblings (.gz, .br), the binary sibling (.wfb, see frame_binary) and the levels of detail (.d1, .d2,
+..., see simplify, each with its own .gz, .br and .wfb) of the stored frames. They are written once at ingest, so the
+api can serve them without encoding per request. Frames that are written often and mostly served at full resolution
+(the danger slots) only get the compressed siblings at ingest, the others are built by write_sibling on first
+request. Brotli is optional, only gzip is written if it isn't installed.
+"""
+import gzip
+import os
+import tempfile
+from typing import Callable, Dict, List, Tuple, Union
+
+from server import frame_binary, serializer, simplify
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Higher brotli qualities take seconds per rain frame (and are paid for every danger slot) for little gain in size,
+# gzip keeps its default level
+brotli_quality = 5
+gzip_level = 6
+
+# content-coding -> (file suffix, compress function), in order of preference
+encodings: Dict[str, Tuple[str, Callable[[bytes], bytes]]] = {}
+if brotli is not None:
+    encodings["br"] = (".br", lambda data: brotli.compress(data, quality=brotli_quality))
+encodings["gzip"] = (".gz", lambda data: gzip.compress(data, compresslevel=gzip_level, mtime=0))
+
+# every suffix that might exist on disk (i.e. written while brotli was installed)
+encoded_suffixes = [".br", ".gz", frame_binary.suffix]
+sibling_suffixes = encoded_suffixes + [simplify.detail_suffix(detail) + suffix
+                                       for detail in range(1, len(simplify.grids) + 1)
+                                       for suffix in [""] + encoded_suffixes]
+
+
+def write_encoded(path: str, data: bytes, features: Union[None, List[dict]]) -> List[str]:
+    """
+    Write the compressed siblings and the binary sibling of a GeoJSON file (path + suffix).
+
+    :param path: the GeoJSON file
+    :param data: the content of the file
+    :param features: the parsed features of the file, None to skip the binary sibling
+    :return: paths of the siblings written
+    """
+    written = []
+    for suffix, compress in encodings.values():
+        with open(path + suffix, "wb") as f:
+            f.write(compress(data))
+        written.append(path + suffix)
+
+    if features is not None:
+        with open(path + frame_binary.suffix, "wb") as f:
+            f.write(frame_binary.encode_features(features))
+        written.append(path + frame_binary.suffix)
+
+    return written
+
+
+def write_siblings(path: str, details: bool = True) -> List[str]:
+    """
+    Write the siblings of a GeoJSON file: the encoded siblings and every level of detail with its encoded siblings.
+
+    :param path: the GeoJSON file
+    :param details: write the binary sibling and the levels of detail, otherwise only the compressed siblings
+    :return: paths of the siblings written
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if not details:
+        return write_encoded(path, data, None)
+
+    features = serializer.loads(data)["features"]
+    written = write_encoded(path, data, features)
+
+    for detail, detail_features in enumerate(simplify.simplify_levels(features), start=1):
+        detail_path = path + simplify.detail_suffix(detail)
+        detail_data = serializer.dumps({"type": "FeatureCollection", "features": detail_features})
+
+        with open(detail_path, "wb") as f:
+            f.write(detail_data)
+
+        written.append(detail_path)
+        written.extend(write_encoded(detail_path, detail_data, detail_features))
+
+    return written
+
+
+def replace_file(path: str, data: bytes):
+    """
+    Write a file through a temp file in the same folder, readers never see a partial file.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_sibling(path: str, encoding: str = "identity", detail: int = 0) -> Union[None, bytes]:
+    """
+    Write a missing sibling of a stored GeoJSON file (and its level of detail if that is missing as well). Used on
+    first request for the frames stored without details, concurrent writes of the same sibling are harmless.
+
+    :param path: the GeoJSON file
+    :param encoding: content-coding of the sibling (or frame_binary.encoding)
+    :param detail: level of detail of the sibling
+    :return: the content of the sibling, None if the file doesn't exist
+    """
+    detail_path = path + simplify.detail_suffix(detail)
+    features = None
+    try:
+        with open(detail_path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        if detail == 0:
+            return None
+        try:
+            with open(path, "rb") as f:
+                features = simplify.simplify_levels(serializer.loads(f.read())["features"], detail)[-1]
+        except FileNotFoundError:
+            return None
+
+        data = serializer.dumps({"type": "FeatureCollection", "features": features})
+        replace_file(detail_path, data)
+
+    if encoding == "identity":
+        return data
+
+    if encoding == frame_binary.encoding:
+        if features is None:
+            features = serializer.loads(data)["features"]
+        encoded = frame_binary.encode_features(features)
+    else:
+        encoded = encodings[encoding][1](data)
+
+    replace_file(encoded_path(detail_path, encoding), encoded)
+    return encoded
+
+
+def rename_frame(src: str, dst: str):
+    """
+    Rename a file with its siblings. The siblings are moved first, so they exist once the main file does.
+    """
+    for suffix in sibling_suffixes:
+        if os.path.exists(src + suffix):
+            os.rename(src + suffix, dst + suffix)
+
+    os.rename(src, dst)
+
+
+def remove_frame(path: str) -> bool:
+    """
+    Remove a file and its siblings.
+
+    :return: True if the main file existed
+    """
+    for suffix in sibling_suffixes:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+
+    return False
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """
+    Pick the preferred available content-coding from an Accept-Encoding header, identity if none is acceptable.
+    """
+    if not accept_encoding:
+        return "identity"
+
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+
+    for coding in encodings:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+
+    return "identity"
+
+
+def encoded_path(path: str, encoding: str) -> str:
+    """
+    Path of the file holding the given encoding of a frame (content-coding or frame_binary.encoding).
+    """
+    if encoding == "identity":
+        return path
+    if encoding == frame_binary.encoding:
+        return path + frame_binary.suffix
+
+    return path + encodings[encoding][0]
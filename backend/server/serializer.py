@@ -0,0 +1,50 @@
+"""
+JSON serialization used for all stored frames. Uses orjson if it is installed and falls back to the json module of
+the standard library. Both produce compact UTF-8 output (no whitespace, no escaped non-ASCII characters), but the
+bytes can differ: floats in exponent notation are written differently (json 1e-05 and 1e+20, orjson 0.00001 and
+1e20) and NaN / Infinity are written as null by orjson while the json fallback raises a ValueError.
+"""
+import json
+from typing import Any, IO, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+backend = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serialize an object to compact json.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, allow_nan=False).encode()
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Parse json.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def dump(obj: Any, f: IO[bytes]):
+    """
+    Serialize an object to a file opened in binary mode.
+    """
+    f.write(dumps(obj))
+
+
+def load(f: IO) -> Any:
+    """
+    Parse the json of a file (binary or text mode).
+    """
+    return loads(f.read())
@@ -0,0 +1,289 @@
+"""
+Levels of detail of the stored frames. Per level every ring is simplified with Douglas-Peucker (tolerance = grid
+size), snapped to the grid and the repeated and collinear vertices are dropped. The rings are simplified one by one,
+the error (and so any overlap between neighbouring rings) is bounded by the grid size, which is below a pixel at the
+zooms a level is used for. The simplification can fold a ring over itself, the simplified rings are validated and a
+feature with a self-intersecting ring is taken from the next finer level instead.
+
+All rings of a frame are processed together (one numpy pass per Douglas-Peucker depth), a frame has thousands of
+small rings.
+"""
+import math
+from typing import List, Tuple, Union
+
+import numpy as np
+
+# grid size in degrees per detail level (detail 0 is the full resolution)
+grids = [0.0005, 0.002, 0.01]
+# lowest zoom served at full resolution, per detail level the lowest zoom it is used for
+detail_zooms = [12, 10, 8, 0]
+
+
+def detail_for_zoom(zoom: int) -> int:
+    """
+    Detail level matching a map zoom level (about one grid cell per pixel).
+    """
+    for detail, min_zoom in enumerate(detail_zooms):
+        if zoom >= min_zoom:
+            return detail
+
+    return len(grids)
+
+
+def detail_suffix(detail: int) -> str:
+    """
+    Suffix of the stored frame of a detail level (appended to the path of the full resolution frame).
+    """
+    return f".d{detail}" if detail > 0 else ""
+
+
+def douglas_peucker(points: np.ndarray, starts: np.ndarray, ends: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of many lines (or closed rings, first point = last point) at once.
+
+    :param points: the points of all lines
+    :param starts: index of the first point of every line
+    :param ends: index of the last point of every line
+    :param tolerance: maximum distance of a removed point to the simplified line
+    :return: mask of the points to keep
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+
+    while len(starts) > 0:
+        inner_counts = ends - starts - 1
+        split = inner_counts > 0
+        starts, ends, inner_counts = starts[split], ends[split], inner_counts[split]
+        if len(starts) == 0:
+            break
+
+        # the inner points of every segment, segment by segment
+        segment = np.repeat(np.arange(len(starts)), inner_counts)
+        group_starts = np.cumsum(inner_counts) - inner_counts
+        inner = starts[segment] + 1 + np.arange(len(segment)) - group_starts[segment]
+
+        a = points[starts][segment]
+        d = points[ends][segment] - a
+        p = points[inner] - a
+        length = np.hypot(d[:, 0], d[:, 1])
+        cross = np.abs(d[:, 0] * p[:, 1] - d[:, 1] * p[:, 0])
+        distance = np.where(length > 0, cross / np.where(length > 0, length, 1), np.hypot(p[:, 0], p[:, 1]))
+
+        # farthest point of every segment (the first one if there are several)
+        farthest_distance = np.maximum.reduceat(distance, group_starts)
+        candidates = np.nonzero(distance == farthest_distance[segment])[0]
+        _, first = np.unique(segment[candidates], return_index=True)
+        farthest = inner[candidates[first]]
+
+        split = farthest_distance > tolerance
+        keep[farthest[split]] = True
+        starts, ends = (np.concatenate((starts[split], farthest[split])),
+                        np.concatenate((farthest[split], ends[split])))
+
+    return keep
+
+
+def clean_rings(points: np.ndarray, ring: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Remove repeated and collinear (exactly, on the grid - that includes spikes) vertices of open rings and the rings
+    with less than 3 vertices left.
+
+    :param points: integer grid points of all rings, ring by ring
+    :param ring: ring number of every point
+    :return: the remaining points and their ring numbers
+    """
+    while len(points) > 0:
+        first = np.nonzero(np.r_[True, ring[1:] != ring[:-1]])[0]
+        counts = np.diff(np.r_[first, len(ring)])
+        start = np.repeat(first, counts)
+        end = np.repeat(first + counts - 1, counts)
+        index = np.arange(len(points))
+
+        previous = points[np.where(index == start, end, index - 1)]
+        following = points[np.where(index == end, start, index + 1)]
+
+        remove = np.repeat(counts < 3, counts)
+        repeated = np.all(points == previous, axis=1)
+        if repeated.any():
+            remove |= repeated
+        else:
+            cross = ((points[:, 0] - previous[:, 0]) * (following[:, 1] - points[:, 1])
+                     - (points[:, 1] - previous[:, 1]) * (following[:, 0] - points[:, 0]))
+            remove |= cross == 0
+
+        if not remove.any():
+            break
+        points, ring = points[~remove], ring[~remove]
+
+    return points, ring
+
+
+def segments_intersect(p1: np.ndarray, p2: np.ndarray, q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
+    """
+    Check pairs of segments p1-p2 and q1-q2 (integer grid points, one pair per row) for intersection, touching
+    segments intersect. Exact, the cross products fit into int64 for grid coordinates.
+    """
+    def orientation(a: np.ndarray, b: np.ndarray, c: np.ndarray) -> np.ndarray:
+        return np.sign((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]))
+
+    o1, o2 = orientation(p1, p2, q1), orientation(p1, p2, q2)
+    o3, o4 = orientation(q1, q2, p1), orientation(q1, q2, p2)
+    crossing = (o1 * o2 <= 0) & (o3 * o4 <= 0)
+
+    # segments on the same line intersect if their extents overlap
+    collinear = (o1 == 0) & (o2 == 0)
+    overlap = np.all(np.maximum(np.minimum(p1, p2), np.minimum(q1, q2))
+                     <= np.minimum(np.maximum(p1, p2), np.maximum(q1, q2)), axis=1)
+
+    return crossing & (~collinear | overlap)
+
+
+def self_intersecting(points: np.ndarray, ring: np.ndarray, max_pairs: int = 1 << 20) -> np.ndarray:
+    """
+    Find the open rings of which two non-adjacent edges intersect. Only the edges of a ring whose x extents overlap
+    are compared (sweep over the edges sorted by ring and x), at most max_pairs pairs at a time.
+
+    :param points: integer grid points of all rings, ring by ring (as returned by clean_rings)
+    :param ring: ring number of every point
+    :return: the ring numbers of the self-intersecting rings
+    """
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # edge i runs from point i to the following point of its ring
+    first = np.nonzero(np.r_[True, ring[1:] != ring[:-1]])[0]
+    counts = np.diff(np.r_[first, len(ring)])
+    index = np.arange(len(points))
+    following = np.where(index == np.repeat(first + counts - 1, counts), np.repeat(first, counts), index + 1)
+    low = np.minimum(points, points[following])
+    high = np.maximum(points, points[following])
+
+    # candidates of an edge: the edges of the same ring after it in the order, up to the first starting after its end
+    x_offset = low[:, 0].min()
+    ring_key = ring.astype(np.int64) << 32
+    order = np.argsort(ring_key | (low[:, 0] - x_offset), kind="stable")
+    sorted_key = (ring_key | (low[:, 0] - x_offset))[order]
+    stop = np.searchsorted(sorted_key, (ring_key | (high[:, 0] - x_offset))[order], side="right")
+    candidates = stop - np.arange(len(order)) - 1
+    total = np.cumsum(candidates)
+
+    invalid = []
+    chunk_start = 0
+    while chunk_start < len(order):
+        done = total[chunk_start - 1] if chunk_start > 0 else 0
+        chunk_end = max(chunk_start + 1, int(np.searchsorted(total, done + max_pairs, side="right")))
+        positions = np.arange(chunk_start, chunk_end)
+        chunk_candidates = candidates[chunk_start:chunk_end]
+        chunk_start = chunk_end
+        if chunk_candidates.sum() == 0:
+            continue
+
+        # every position paired with the positions following it
+        position = np.repeat(positions, chunk_candidates)
+        group_starts = np.cumsum(chunk_candidates) - chunk_candidates
+        offset = np.arange(len(position)) - np.repeat(group_starts, chunk_candidates)
+        a, b = order[position], order[position + 1 + offset]
+
+        check = ((low[a, 1] <= high[b, 1]) & (low[b, 1] <= high[a, 1])
+                 & (following[a] != b) & (following[b] != a))
+        a, b = a[check], b[check]
+        hit = segments_intersect(points[a], points[following[a]], points[b], points[following[b]])
+        invalid.extend(ring[a[hit]].tolist())
+
+    return np.unique(np.array(invalid, dtype=np.int64))
+
+
+def simplify_features(features: List[dict], grid: float,
+                      finer: List[Union[None, dict]] = None) -> List[Union[None, dict]]:
+    """
+    Simplify the features of a frame, polygons with a collapsed exterior ring and empty features are dropped.
+
+    :param features: the features at full resolution
+    :param grid: the grid size of the level
+    :param finer: the features of the next finer level (same order, None for dropped features), the full resolution
+        features if None. A feature with a self-intersecting ring is taken from it.
+    :return: the simplified features in the order of features, None for the dropped ones
+    """
+    if finer is None:
+        finer = features
+
+    # (feature, polygon, ring) of every ring and all points, ring by ring
+    ring_keys = []
+    rings = []
+    for feature_index, feature in enumerate(features):
+        geometry = feature["geometry"]
+        polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+        for polygon_index, polygon in enumerate(polygons):
+            for ring_index, ring in enumerate(polygon):
+                if len(ring) >= 4:
+                    ring_keys.append((feature_index, polygon_index, ring_index))
+                    rings.append(ring)
+
+    if len(rings) == 0:
+        return [None] * len(features)
+
+    counts = np.array([len(ring) for ring in rings])
+    ends = np.cumsum(counts) - 1
+    starts = ends - counts + 1
+    points = np.array([point for ring in rings for point in ring], dtype=np.float64)
+
+    keep = douglas_peucker(points, starts, ends, grid)
+    # the rings are closed, the cleaning works on open rings
+    keep[ends] = False
+    ring_numbers = np.repeat(np.arange(len(rings)), counts)[keep]
+    points, ring_numbers = clean_rings(np.round(points[keep] / grid).astype(np.int64), ring_numbers)
+    if len(points) == 0:
+        return [None] * len(features)
+    invalid = {ring_keys[number][0] for number in self_intersecting(points, ring_numbers).tolist()}
+
+    decimals = max(0, math.ceil(-math.log10(grid)))
+    coordinates = np.round(points * grid, decimals).tolist()
+    first = np.nonzero(np.r_[True, ring_numbers[1:] != ring_numbers[:-1]])[0].tolist()
+    bounds = zip(first, first[1:] + [len(coordinates)])
+
+    # feature -> polygon -> ring -> closed ring
+    simplified = {}
+    for (start, end), number in zip(bounds, ring_numbers[first].tolist()):
+        feature_index, polygon_index, ring_index = ring_keys[number]
+        simplified.setdefault(feature_index, {}).setdefault(polygon_index, {})[ring_index] = \
+            coordinates[start:end] + coordinates[start:start + 1]
+
+    result = [None] * len(features)
+    for feature_index, polygons in simplified.items():
+        if feature_index in invalid:
+            result[feature_index] = finer[feature_index]
+            continue
+
+        feature = features[feature_index]
+        geometry_type = feature["geometry"]["type"]
+
+        # a polygon without its exterior ring is dropped
+        polygons = [[ring for _, ring in sorted(polygon.items())] for _, polygon in sorted(polygons.items())
+                    if 0 in polygon]
+        if len(polygons) == 0:
+            continue
+
+        result[feature_index] = {
+            "type": "Feature",
+            "geometry": {"type": geometry_type, "coordinates": polygons[0] if geometry_type == "Polygon" else polygons},
+            "properties": feature["properties"],
+        }
+
+    return result
+
+
+def simplify_levels(features: List[dict], levels: int = len(grids)) -> List[List[dict]]:
+    """
+    Simplify the features of a frame to the first levels of detail, each level falling back to the previous one for
+    the features it can't simplify without self-intersection.
+
+    :return: the features of level 1 to levels
+    """
+    result = []
+    finer = None
+    for grid in grids[:levels]:
+        finer = simplify_features(features, grid, finer)
+        result.append([feature for feature in finer if feature is not None])
+
+    return result
@@ -0,0 +1,124 @@
+import datetime
+import threading
+from typing import Dict, Iterable, Set, Tuple, Union
+
+import pytz
+
+
+class SlotTracker:
+    slot = datetime.timedelta(minutes=5)
+
+    def __init__(self):
+        """
+        Set of the 5 minute slots whose inputs changed since the last take (i.e. the slots of the danger data that
+        need to be regenerated). Starts with everything dirty, so the first take asks for a full sweep. Safe to use
+        from several threads.
+        """
+        self._dirty: Set[datetime.datetime] = set()
+        self._all = True
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _utc(dt: datetime.datetime) -> datetime.datetime:
+        return pytz.utc.localize(dt) if dt.tzinfo is None else dt.astimezone(pytz.utc)
+
+    def mark(self, dts: Iterable[datetime.datetime]):
+        """
+        Mark slots as dirty.
+        """
+        with self._lock:
+            self._dirty.update(self._utc(dt) for dt in dts)
+
+    def mark_range(self, start: datetime.datetime, end: datetime.datetime):
+        """
+        Mark the slots in [start, end) as dirty (i.e. the hour a wind record is valid for).
+        """
+        start = self._utc(start)
+        end = self._utc(end)
+
+        dts = []
+        while start < end:
+            dts.append(start)
+            start += self.slot
+
+        self.mark(dts)
+
+    def mark_all(self):
+        """
+        Ask for a full sweep with the next take.
+        """
+        with self._lock:
+            self._all = True
+
+    def take(self) -> Union[None, Set[datetime.datetime]]:
+        """
+        Get the dirty slots and reset them.
+
+        :return: the (utc) dirty slots, None for all slots
+        """
+        with self._lock:
+            if self._all:
+                self._all = False
+                self._dirty = set()
+                return None
+
+            dirty, self._dirty = self._dirty, set()
+            return dirty
+
+    def restore(self, dirty: Union[None, Set[datetime.datetime]]):
+        """
+        Put back the result of a take (i.e. the regeneration failed).
+        """
+        if dirty is None:
+            self.mark_all()
+        else:
+            self.mark(dirty)
+
+
+class SlotBackoff:
+    def __init__(self, delay: float, max_delay: float):
+        """
+        Delays the retries of the 5 minute slots the upstream doesn't have (i.e. a hole in the radar timeline that is
+        never filled). After the first miss a slot is skipped for delay seconds, the delay doubles with every further
+        miss up to max_delay. Safe to use from several threads.
+
+        :param delay: seconds until the first retry
+        :param max_delay: longest delay between two retries
+        """
+        self.delay = delay
+        self.max_delay = max_delay
+        # slot -> (consecutive misses, time of the next retry)
+        self._slots: Dict[datetime.datetime, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def due(self, dt: datetime.datetime, now: float) -> bool:
+        """
+        Check if a slot should be requested.
+
+        :param now: the current time (time.monotonic)
+        """
+        with self._lock:
+            return dt not in self._slots or self._slots[dt][1] <= now
+
+    def miss(self, dt: datetime.datetime, now: float):
+        """
+        Record that the upstream doesn't have a slot.
+        """
+        with self._lock:
+            misses = self._slots[dt][0] + 1 if dt in self._slots else 1
+            self._slots[dt] = (misses, now + min(self.delay * 2 ** (misses - 1), self.max_delay))
+
+    def forget_before(self, dt: datetime.datetime):
+        """
+        Drop the slots before dt (i.e. out of the backfill window).
+        """
+        with self._lock:
+            self._slots = {slot: value for slot, value in self._slots.items() if slot >= dt}
+
+    def clear(self, dts: Iterable[datetime.datetime]):
+        """
+        Drop slots that have been fetched.
+        """
+        with self._lock:
+            for dt in dts:
+                self._slots.pop(dt, None)
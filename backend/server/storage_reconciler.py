@@ -0,0 +1,144 @@
+"""
+Removes the files of the storage that no record references anymore (i.e. the frames of records expired by the TTL
+indexes, see mongo_db_common, and temp files left behind by an interrupted crawler).
+
+The storage is scanned incrementally: one directory listing is consumed across the steps, a batch of files per step,
+and started again once it's exhausted, so a step costs the same however large the storage is. A file belongs to the
+frame named by the part before the first dot (digest or record id, see blob_store), the frames of a batch are checked
+with one query per collection. The listing is in no particular order, the files of a frame may come in different
+batches and each part is handled on its own (a sibling removed without its main file is written again by the api on
+first request). Recently modified files are skipped, a frame is stored before its record is inserted.
+
+The reconciler is the only one removing blobs, the crawler reuses them concurrently (blob_store.commit_frames touches
+the main file of a blob before its record is inserted, or stores its copy if the main file is gone). An unreferenced
+frame is claimed by renaming its main file to a tombstone, a main file touched before the claim shows in the mtime of
+the tombstone and the frame is restored. Once claimed, a reusing crawler stores its own copy under the main name.
+"""
+import os
+import time
+from typing import Dict, Iterator, List, Union
+
+import server.mongo_db_common as mdbc
+from server.mongo_db_api import MongoAPI
+
+# suffix of the main file of a frame claimed for removal
+tombstone_suffix = ".removing"
+
+
+class StorageReconciler:
+    storage: str
+    batch_size: int
+    grace: int
+
+    def __init__(self, storage: str, batch_size: int, grace: int):
+        """
+        :param storage: the storage folder
+        :param batch_size: number of files checked per step
+        :param grace: files modified less than grace seconds ago are kept
+        """
+        self.storage = storage
+        self.batch_size = batch_size
+        self.grace = grace
+        # listing of the current round, None to start the next one
+        self._scan: Union[None, Iterator[os.DirEntry]] = None
+
+    def step(self, mongo: MongoAPI) -> int:
+        """
+        Check the next batch of files and remove the unreferenced ones.
+
+        :return: number of files removed
+        """
+        if self._scan is None:
+            self._scan = os.scandir(self.storage)
+
+        batch = []
+        for entry in self._scan:
+            if entry.is_file():
+                batch.append(entry)
+                if len(batch) == self.batch_size:
+                    break
+        else:
+            # end of the storage reached, start over with the next step
+            self._scan = None
+
+        if len(batch) == 0:
+            return 0
+
+        frames: Dict[str, List[os.DirEntry]] = {}
+        for entry in batch:
+            frames.setdefault(entry.name.split(".", 1)[0], []).append(entry)
+
+        referenced = mdbc.get_referenced_names(mongo, list(frames))
+        cutoff = time.time() - self.grace
+
+        removed = 0
+        for name, entries in frames.items():
+            if name in referenced:
+                self.restore(entries)
+            else:
+                removed += self.remove_frame(entries, cutoff) or 0
+
+        return removed
+
+    @staticmethod
+    def restore(entries: List[os.DirEntry]):
+        """
+        Put back the main file of a referenced frame left claimed (i.e. by an interrupted step).
+        """
+        for entry in entries:
+            if entry.name.endswith(tombstone_suffix):
+                main = entry.path[:-len(tombstone_suffix)]
+                try:
+                    if os.path.exists(main):
+                        os.remove(entry.path)
+                    else:
+                        os.rename(entry.path, main)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def remove_frame(entries: List[os.DirEntry], cutoff: float) -> Union[None, int]:
+        """
+        Remove the files of an unreferenced frame unless one of them was modified after cutoff.
+
+        :param entries: the files of the frame (main file, siblings, tombstone)
+        :param cutoff: files modified after are in use
+        :return: number of files removed, None if the frame is kept
+        """
+        try:
+            if any(entry.stat().st_mtime >= cutoff for entry in entries):
+                return None
+        except FileNotFoundError:
+            # changed since the scan, checked again with the next round
+            return None
+
+        # main files are the ones without a sibling suffix
+        mains = [entry.path for entry in entries if entry.name.count(".") == 1]
+        tombstones = [entry.path for entry in entries if entry.name.endswith(tombstone_suffix)]
+
+        claimed = []
+        for main in mains:
+            try:
+                os.rename(main, main + tombstone_suffix)
+                claimed.append(main)
+            except FileNotFoundError:
+                pass
+
+        # touched between the scan and the claim: reused by the crawler
+        for main in claimed:
+            if os.stat(main + tombstone_suffix).st_mtime >= cutoff:
+                for path in claimed:
+                    os.rename(path + tombstone_suffix, path)
+                return None
+
+        # siblings replaced by the copy of a concurrent commit go as well, the api writes them again on first request
+        removed = 0
+        paths = [entry.path for entry in entries if entry.path not in mains and entry.path not in tombstones]
+        for path in paths + [main + tombstone_suffix for main in claimed] + tombstones:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+
+        return removed
@@ -0,0 +1,136 @@
+import datetime
+import threading
+from typing import Dict, List, Tuple, Union
+
+import bson
+import pytz
+
+import server.mongo_db_common as mdbc
+from server.mongo_db_api import MongoAPI, string_to_object_id
+from server.mongodb_data_models import *
+
+# Records are ordered like the sort of the corresponding lookup in mongo_db_common (None sorts lowest)
+_lowest = datetime.datetime.min
+
+
+def _rain_rank(record: RainRecord):
+    return record.version is not None, record.version or _lowest
+
+
+def _wind_rank(record: WindRecord):
+    return record.version or _lowest
+
+
+def _danger_rank(record: DangerRecord):
+    return record.rain_version or _lowest, record.wind_version or _lowest
+
+
+class TimelineIndex:
+    slot_seconds = 300
+
+    def __init__(self, slots: int = 1024):
+        """
+        In memory index from a 5 minute slot to the newest record of every product (rain, wind_speed,
+        wind_direction, danger). Every product is a dense ring of slots (1024 slots = 3.5 days, which covers 24h
+        of radar and 48h of prediction), so a lookup is O(1) without a database round trip.
+
+        The index is updated incrementally with the records inserted since the last refresh.
+
+        :param slots: number of slots per product
+        """
+        self.slots = slots
+        self.rain_version: Union[None, datetime.datetime] = None
+        self.wind_version: Union[None, datetime.datetime] = None
+
+        self._timeline: Dict[str, List[Union[None, Tuple[int, Union[RainRecord, WindRecord, DangerRecord]]]]] = {
+            "rain": [None] * slots,
+            "wind_speed": [None] * slots,
+            "wind_direction": [None] * slots,
+            "danger": [None] * slots,
+        }
+        self._last_ids: Dict[str, Union[None, bson.ObjectId]] = {"rain_data": None, "wind_data": None,
+                                                                 "danger_data": None}
+        self._lock = threading.Lock()
+
+    def _slot(self, dt: datetime.datetime) -> int:
+        if dt.tzinfo is None:
+            dt = pytz.utc.localize(dt)
+        return int(dt.timestamp()) // self.slot_seconds
+
+    def resolve(self, product: str, dt: datetime.datetime):
+        """
+        Get the newest record of the product at the given date. None if the index doesn't know one.
+        """
+        slot = self._slot(dt)
+        entry = self._timeline[product][slot % self.slots]
+        if entry is None or entry[0] != slot:
+            return None
+
+        return entry[1]
+
+    def _add(self, product: str, record, rank):
+        slot = self._slot(record.dt)
+        timeline = self._timeline[product]
+        entry = timeline[slot % self.slots]
+
+        # Keep newer slots (the ring wrapped around) and newer versions
+        if entry is not None and (entry[0] > slot or (entry[0] == slot and rank(entry[1]) > rank(record))):
+            return
+
+        timeline[slot % self.slots] = (slot, record)
+
+    def _since(self, collection: str) -> Union[None, bson.ObjectId]:
+        """
+        Query start for a collection. Overlaps the last two seconds, since ids of different processes created in
+        the same second aren't ordered. Re-adding a record is a no-op.
+        """
+        last_id = self._last_ids[collection]
+        if last_id is None:
+            return None
+
+        return bson.ObjectId.from_datetime(last_id.generation_time - datetime.timedelta(seconds=2))
+
+    def refresh(self, mongo: MongoAPI) -> bool:
+        """
+        Add the records inserted since the last refresh.
+
+        :return: True if records were read
+        """
+        with self._lock:
+            rain = mdbc.get_rain_records_since(mongo, self._since("rain_data"))
+            wind = mdbc.get_wind_records_since(mongo, self._since("wind_data"))
+            danger = mdbc.get_danger_records_since(mongo, self._since("danger_data"))
+
+            for record in rain:
+                self._add("rain", record, _rain_rank)
+                if record.version is not None and (self.rain_version is None or record.version > self.rain_version):
+                    self.rain_version = record.version
+
+            for record in wind:
+                product = "wind_speed" if record.type == WindRecordType.strength else "wind_direction"
+                self._add(product, record, _wind_rank)
+                if record.version is not None and (self.wind_version is None or record.version > self.wind_version):
+                    self.wind_version = record.version
+
+            for record in danger:
+                self._add("danger", record, _danger_rank)
+
+            for collection, records in (("rain_data", rain), ("wind_data", wind), ("danger_data", danger)):
+                if len(records) == 0:
+                    continue
+
+                last_id = string_to_object_id(records[-1].record_id)
+                if self._last_ids[collection] is None or last_id > self._last_ids[collection]:
+                    self._last_ids[collection] = last_id
+
+            return len(rain) + len(wind) + len(danger) > 0
+
+    def forget(self, product: str, dt: datetime.datetime):
+        """
+        Remove the entry of a slot (i.e. because its record has been pruned).
+        """
+        slot = self._slot(dt)
+        timeline = self._timeline[product]
+        entry = timeline[slot % self.slots]
+        if entry is not None and entry[0] == slot:
+            timeline[slot % self.slots] = None
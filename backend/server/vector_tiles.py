@@ -0,0 +1,229 @@
+"""
+Vector tiles (z/x/y, web mercator tiling) of the stored GeoJSON frames. A tile is a GeoJSON FeatureCollection of the
+polygons of a frame clipped to the tile (plus a small buffer) and simplified by snapping them to the pixel grid of a
+256 px tile.
+"""
+import math
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from server import serializer
+
+max_zoom = 14
+tile_size = 256
+# pixels around the tile that are kept, so the outlines of neighbouring tiles overlap
+buffer = 4
+
+
+def to_mercator(coordinates: np.ndarray) -> np.ndarray:
+    """
+    Project lng / lat to web mercator, normalized to [0, 1] (y pointing south).
+    """
+    x = (coordinates[:, 0] + 180) / 360
+    lat = np.radians(coordinates[:, 1])
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2
+    return np.column_stack((x, y))
+
+
+def from_mercator(points: np.ndarray) -> np.ndarray:
+    """
+    Inverse of to_mercator.
+    """
+    lng = points[:, 0] * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * points[:, 1]))))
+    return np.column_stack((lng, lat))
+
+
+def clip_half_plane(points: np.ndarray, axis: int, value: float, keep_greater: bool) -> np.ndarray:
+    """
+    Sutherland-Hodgman step: clip an open ring against the half plane points[:, axis] >= value (or <= value).
+    """
+    if len(points) == 0:
+        return points
+
+    coordinate = points[:, axis]
+    inside = coordinate >= value if keep_greater else coordinate <= value
+    if inside.all():
+        return points
+
+    previous = np.roll(points, 1, axis=0)
+    previous_inside = np.roll(inside, 1)
+    crossing = inside != previous_inside
+
+    # only the crossing edges are used, the others may divide by zero
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (value - previous[:, axis]) / (coordinate - previous[:, axis])
+        intersection = previous + t[:, None] * (points - previous)
+
+    # per edge (previous -> point): the intersection if it crosses, then the point if it is inside
+    counts = crossing.astype(np.int64) + inside
+    starts = np.cumsum(counts) - counts
+    result = np.empty((counts.sum(), 2))
+    result[starts[crossing]] = intersection[crossing]
+    result[(starts + crossing)[inside]] = points[inside]
+    return result
+
+
+def clip_ring(points: np.ndarray, low: float, high: float) -> np.ndarray:
+    """
+    Clip an open ring to the square [low, high] x [low, high].
+    """
+    for axis in (0, 1):
+        points = clip_half_plane(points, axis, low, True)
+        points = clip_half_plane(points, axis, high, False)
+
+    return points
+
+
+def snap_ring(points: np.ndarray) -> np.ndarray:
+    """
+    Snap an open ring to the pixel grid and drop repeated points, empty if less than 3 points are left.
+    """
+    snapped = np.round(points)
+    keep = np.any(snapped != np.roll(snapped, 1, axis=0), axis=1)
+    snapped = snapped[keep]
+    if len(snapped) < 3:
+        return snapped[:0]
+
+    return snapped
+
+
+class FrameGeometry:
+    """
+    The polygons of a frame projected to web mercator, with the bounding box of every exterior ring.
+    """
+
+    def __init__(self, geojson: dict):
+        self.features: List[Tuple[dict, str, List[List[np.ndarray]]]] = []
+        polygon_keys = []
+        bboxes = []
+
+        for feature in geojson["features"]:
+            geometry = feature["geometry"]
+            polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+
+            projected = []
+            for polygon in polygons:
+                # rings are stored closed, the clipping works on open rings
+                rings = [to_mercator(np.array(ring, dtype=np.float64)[:-1]) for ring in polygon if len(ring) > 3]
+                if len(rings) == 0:
+                    continue
+
+                polygon_keys.append((len(self.features), len(projected)))
+                bboxes.append(np.concatenate((rings[0].min(axis=0), rings[0].max(axis=0))))
+                projected.append(rings)
+
+            self.features.append((feature["properties"], geometry["type"], projected))
+
+        self.polygon_keys = polygon_keys
+        self.bboxes = np.array(bboxes).reshape(-1, 4)
+
+    def tile(self, z: int, x: int, y: int) -> dict:
+        """
+        Clip and simplify the frame to a tile.
+
+        :return: the GeoJSON FeatureCollection of the tile
+        """
+        scale = 2 ** z
+        margin = buffer / tile_size
+        west, north = (x - margin) / scale, (y - margin) / scale
+        east, south = (x + 1 + margin) / scale, (y + 1 + margin) / scale
+
+        hits = np.nonzero((self.bboxes[:, 0] <= east) & (self.bboxes[:, 2] >= west)
+                          & (self.bboxes[:, 1] <= south) & (self.bboxes[:, 3] >= north))[0]
+
+        # ~1 pixel in degrees, coordinates are rounded to that precision
+        decimals = max(0, math.ceil(math.log10(tile_size * scale / 360))) + 1
+        offset = np.array([x, y], dtype=np.float64)
+        inside_low, inside_high = -buffer, tile_size + buffer
+
+        selected = OrderedDict()
+        for hit in hits:
+            feature_index, polygon_index = self.polygon_keys[hit]
+            rings = self.features[feature_index][2][polygon_index]
+            fully_inside = (self.bboxes[hit, 0] >= west and self.bboxes[hit, 2] <= east
+                            and self.bboxes[hit, 1] >= north and self.bboxes[hit, 3] <= south)
+
+            tile_rings = []
+            for ring in rings:
+                pixels = (ring * scale - offset) * tile_size
+                if not fully_inside:
+                    pixels = clip_ring(pixels, inside_low, inside_high)
+                pixels = snap_ring(pixels)
+
+                if len(pixels) == 0:
+                    # the exterior ring vanished, so does the polygon
+                    if len(tile_rings) == 0:
+                        break
+                    continue
+
+                lng_lat = np.round(from_mercator((pixels / tile_size + offset) / scale), decimals)
+                tile_rings.append(np.vstack((lng_lat, lng_lat[:1])).tolist())
+
+            if len(tile_rings) > 0:
+                selected.setdefault(feature_index, []).append(tile_rings)
+
+        features = []
+        for feature_index, polygons in selected.items():
+            properties, geometry_type, _ = self.features[feature_index]
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": geometry_type,
+                             "coordinates": polygons[0] if geometry_type == "Polygon" else polygons},
+                "properties": properties,
+            })
+
+        return {"type": "FeatureCollection", "features": features}
+
+
+class TileRenderer:
+    max_frames: int
+
+    def __init__(self, max_frames: int):
+        """
+        Renders tiles, the projected geometry of the last max_frames frames is kept.
+
+        :param max_frames: number of prepared frames to keep
+        """
+        self.max_frames = max_frames
+        self._frames: "OrderedDict[str, FrameGeometry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def frame(self, record_id: str, load: Callable[[], dict]) -> FrameGeometry:
+        """
+        Get the prepared geometry of a frame, load is called to get the GeoJSON if it isn't prepared yet.
+        """
+        with self._lock:
+            geometry = self._frames.get(record_id)
+            if geometry is not None:
+                self._frames.move_to_end(record_id)
+                return geometry
+
+        geometry = FrameGeometry(load())
+
+        with self._lock:
+            self._frames[record_id] = geometry
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+
+        return geometry
+
+    def render(self, record_id: str, load: Callable[[], dict], z: int, x: int, y: int) -> bytes:
+        """
+        Render a tile of a frame.
+
+        :param record_id: id of the frame's record
+        :param load: function returning the GeoJSON of the frame
+        :return: the serialized GeoJSON of the tile
+        """
+        return serializer.dumps(self.frame(record_id, load).tile(z, x, y))
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    """
+    Check if z/x/y addresses a tile (z <= max_zoom).
+    """
+    return 0 <= z <= max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z
@@ -0,0 +1,84 @@
+import threading
+from typing import Callable, Dict, List, Union
+
+import requests as rq
+
+
+class VersionWatcher:
+    session: rq.Session
+    url: str
+    versions: Dict[str, str]
+
+    def __init__(self, session: rq.Session, url: str):
+        """
+        Shared poller for the versions.json of meteoswiss. One document covers all products, so it is fetched once
+        per cycle (using ETag / If-Modified-Since) and subscribers are only notified if their own key changed.
+
+        :param session: requests session to use
+        :param url: url of the versions.json
+        """
+        self.session = session
+        self.url = url
+        self.versions = {}
+
+        self._etag: Union[None, str] = None
+        self._last_modified: Union[None, str] = None
+        self._subscribers: Dict[str, List[Callable[[], None]]] = {}
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.not_modified = 0
+
+    def subscribe(self, key: str, callback: Callable[[], None]):
+        """
+        Call the callback whenever the version of the key changes.
+
+        :param key: key in the versions.json, i.e. inca/precipitation/rate
+        :param callback: function without arguments, called from the polling thread
+        """
+        self._subscribers.setdefault(key, []).append(callback)
+
+    def poll(self) -> List[str]:
+        """
+        Fetch the versions.json if it has been modified and notify the subscribers of the changed keys.
+
+        :return: the keys whose version changed
+        """
+        with self._lock:
+            headers = {}
+            if self._etag is not None:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified is not None:
+                headers["If-Modified-Since"] = self._last_modified
+
+            rsp = self.session.get(self.url, headers=headers)
+            self.requests += 1
+
+            if rsp.status_code == 304:
+                self.not_modified += 1
+                return []
+
+            if not rsp.ok:
+                return []
+
+            content = rsp.json()
+            self._etag = rsp.headers.get("ETag")
+            self._last_modified = rsp.headers.get("Last-Modified")
+
+            changed = [key for key, value in content.items() if self.versions.get(key) != value]
+            self.versions = content
+
+        for key in changed:
+            for callback in self._subscribers.get(key, []):
+                callback()
+
+        return changed
+
+    def get(self, key: str) -> Union[None, str]:
+        """
+        Get the cached version of a key, polls once if nothing has been fetched yet.
+        """
+        if len(self.versions) == 0:
+            self.poll()
+
+        return self.versions.get(key)
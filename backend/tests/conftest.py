@@ -0,0 +1,69 @@
+"""
+Test setup. The server modules read their config at import, so the config (data_home in a temp folder, upstream on
+the local fake upstream) is written and WEATHER_FUSION_CONFIG is set before any of them is imported. MongoDB is
+replaced by a shared mongomock client, the tests that need a real mongod use real_mongo_client.
+
+Install requirements-test.txt and run from the backend folder: python -m pytest -q tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import mongomock
+import pymongo
+import pytest
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from fake_upstream import FakeUpstreamHandler, start_fake_upstream  # noqa: E402
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+data_home = tempfile.mkdtemp(prefix="weather_fusion_tests_")
+storage_dir = os.path.join(data_home, "storage")
+os.makedirs(storage_dir)
+
+upstream = start_fake_upstream()
+database = "weather_fusion_tests"
+
+with open(os.path.join(data_home, "server_config.json"), "w") as f:
+    json.dump({
+        "mongo_db": {"username": "test", "password": "test", "address": "localhost", "database": database},
+        "data_home": data_home,
+        "crawler": {"upstream_url": f"http://localhost:{upstream.server_address[1]}", "decode_workers": 1,
+                    "danger_workers": 1},
+    }, f)
+os.environ["WEATHER_FUSION_CONFIG"] = os.path.join(data_home, "server_config.json")
+
+real_mongo_client = pymongo.MongoClient
+mongo_client = mongomock.MongoClient()
+pymongo.MongoClient = lambda *args, **kwargs: mongo_client
+
+with open(os.path.join(fixtures_dir, "meteo_small.json"), "rb") as f:
+    small_frame = f.read()
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """
+    Empty database, empty storage and a fake upstream serving the small fixture frame for every test.
+    """
+    mongo_client.drop_database(database)
+    shutil.rmtree(storage_dir)
+    os.makedirs(storage_dir)
+
+    FakeUpstreamHandler.hits.clear()
+    FakeUpstreamHandler.missing = set()
+    FakeUpstreamHandler.frame_json = small_frame
+    yield
+
+
+def storage_files():
+    """
+    Names of the files in the storage folder.
+    """
+    return sorted(os.listdir(storage_dir))
@@ -0,0 +1,97 @@
+# Local stand-in for the meteoswiss product server, serving the example data as fixture json.
+# Run from the backend folder: python tests/fake_upstream.py [port]
+# and point crawler.upstream_url in the server_config.json to http://localhost:<port>
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+example_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                           "example_data")
+
+with open(os.path.join(example_dir, "meteo.json"), "rb") as f:
+    meteo_json = f.read()
+
+with open(os.path.join(example_dir, "wind-surface.jpg"), "rb") as f:
+    wind_image = f.read()
+
+
+def current_version():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return (now - datetime.timedelta(minutes=now.minute % 5)).strftime("%Y%m%d_%H%M")
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    # path -> number of requests, useful to check how often something was fetched
+    hits = {}
+    hits_lock = threading.Lock()
+
+    # versions served in versions.json, defaults to the current 5 minute slot
+    versions = {}
+
+    # frames (by %Y%m%d_%H%M) which answer with 404
+    missing = set()
+
+    # body of every json frame (rain, radar and wind strength)
+    frame_json = meteo_json
+
+    def do_GET(self):
+        with self.hits_lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+
+        if self.path.endswith("/versions.json"):
+            version = current_version()
+            body = json.dumps({
+                "inca/precipitation/rate": self.versions.get("inca/precipitation/rate", version),
+                "cosmo/wind-10m/images": self.versions.get("cosmo/wind-10m/images", version),
+                "cosmo/wind-2000m/images": self.versions.get("cosmo/wind-2000m/images", version),
+            }).encode()
+
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            return self.respond(200, body, "application/json", {"ETag": etag})
+
+        match = re.search(r"(\d{8}_\d{4})\.(json|png)$", self.path)
+        if match is None or match.group(1) in self.missing:
+            return self.respond(404, b"", "text/plain")
+
+        if match.group(2) == "png":
+            return self.respond(200, wind_image, "image/png")
+        return self.respond(200, self.frame_json, "application/json")
+
+    def respond(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def start_fake_upstream(port: int = 0) -> ThreadingHTTPServer:
+    """
+    Start the fake upstream in a background thread. Use port 0 to get a free port (server.server_address).
+    """
+    server = ThreadingHTTPServer(("localhost", port), FakeUpstreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8123
+    server = ThreadingHTTPServer(("localhost", port), FakeUpstreamHandler)
+    print(f"Serving fake meteoswiss upstream on http://localhost:{server.server_address[1]}")
+    server.serve_forever()
@@ -0,0 +1,220 @@
+"""
+Check that the queries of mongo_db_common are answered by an index. The queries are recorded from the helpers
+themselves (see RecordingMongo), so a changed or new query shape is checked as it is.
+
+Without a database every query is matched against mdbc.indexes (a field bounding each branch of the filter, or the
+sort for an empty filter, is the first key of an index). With a real mongod, at WEATHER_FUSION_TEST_MONGO or on
+localhost, the winning plans are checked for COLLSCAN as well (mongomock has no query planner).
+"""
+import datetime
+import inspect
+import os
+import re
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+import bson
+import pymongo.errors
+import pytest
+
+from conftest import real_mongo_client
+import server.mongo_db_common as mdbc
+from server.mongo_db_api import MongoAPI, object_id_to_string
+from server.mongodb_data_models import WindRecordType
+
+mongo_uri = os.environ.get("WEATHER_FUSION_TEST_MONGO", "mongodb://localhost:27017")
+
+now = datetime.datetime.now(datetime.UTC).replace(minute=0, second=0, microsecond=0)
+oid = bson.ObjectId()
+
+
+class RecordingMongo(MongoAPI):
+    """
+    MongoAPI without a database, records the queries and answers them with find_one_result or nothing.
+    """
+    def __init__(self):
+        self.helper = None
+        self.find_one_result = None
+        # (helper, collection, filter, sort)
+        self.queries: List[Tuple[str, str, dict, Any]] = []
+        # (helper, collection, pipeline, aggregate kwargs)
+        self.pipelines: List[Tuple[str, str, list, dict]] = []
+
+    def find_one(self, collection: str, filter_dict: dict = None, projection_dict: dict = None, sort=None):
+        self.queries.append((self.helper, collection, filter_dict or {}, sort))
+        return self.find_one_result
+
+    def find(self, collection: str, filter_dict: dict = None, projection_dict: dict = None, sort: list = None,
+             skip: int = 0, limit: int = 0):
+        self.queries.append((self.helper, collection, filter_dict or {}, sort))
+        return []
+
+    def count(self, collection: str, filter_dict: dict = None):
+        self.queries.append((self.helper, collection, filter_dict or {}, None))
+        return 0
+
+    def aggregate(self, collection: str, pipeline: list = None, **kwargs):
+        self.pipelines.append((self.helper, collection, pipeline, kwargs))
+        return []
+
+
+# helper -> (call, result of find_one), every helper of mongo_db_common that reads
+helpers: Dict[str, Tuple[Callable[[MongoAPI], Any], Any]] = {
+    "get_latest_radar_record": (mdbc.get_latest_radar_record, None),
+    "get_rain_prediction_version": (mdbc.get_rain_prediction_version, None),
+    "get_wind_prediction_version": (mdbc.get_wind_prediction_version, None),
+    "get_radar_dts": (lambda mongo: mdbc.get_radar_dts(mongo, now, now), None),
+    "get_outdated_rain_prediction_entries": (mdbc.get_outdated_rain_prediction_entries, {"version": now}),
+    "get_rain_record": (lambda mongo: mdbc.get_rain_record(mongo, now), None),
+    "get_rain_records_in_range": (lambda mongo: mdbc.get_rain_records_in_range(mongo, now, now), None),
+    "get_wind_speed": (lambda mongo: mdbc.get_wind_speed(mongo, now), None),
+    "get_wind_direction": (lambda mongo: mdbc.get_wind_direction(mongo, now), None),
+    "get_all_wind_records_of_version": (
+        lambda mongo: mdbc.get_all_wind_records_of_version(mongo, now, WindRecordType.strength), None),
+    "get_danger_keys": (lambda mongo: mdbc.get_danger_keys(mongo, now, now), None),
+    "get_danger_record": (lambda mongo: mdbc.get_danger_record(mongo, now), None),
+    "get_danger_records_in_range": (lambda mongo: mdbc.get_danger_records_in_range(mongo, now, now), None),
+    "get_superseded_wind_records": (mdbc.get_superseded_wind_records, None),
+    "get_superseded_danger_records": (mdbc.get_superseded_danger_records, None),
+    "danger_entry_exists": (
+        lambda mongo: mdbc.danger_entry_exists(now, object_id_to_string(oid), object_id_to_string(oid), mongo), None),
+    "get_rain_records_since": (lambda mongo: mdbc.get_rain_records_since(mongo, oid), None),
+    "get_wind_records_since": (lambda mongo: mdbc.get_wind_records_since(mongo, oid), None),
+    "get_danger_records_since": (lambda mongo: mdbc.get_danger_records_since(mongo, oid), None),
+    "get_referenced_names": (lambda mongo: mdbc.get_referenced_names(mongo, ["a", object_id_to_string(oid)]), None),
+}
+
+recorder = RecordingMongo()
+for helper, (call, find_one_result) in helpers.items():
+    recorder.helper = helper
+    recorder.find_one_result = find_one_result
+    call(recorder)
+
+query_ids = [f"{helper}-{collection}" for helper, collection, _, _ in recorder.queries]
+pipeline_ids = [helper for helper, _, _, _ in recorder.pipelines]
+
+
+def sort_keys(sort) -> List[Tuple[str, int]]:
+    if sort is None:
+        return []
+    return list(sort.items()) if isinstance(sort, dict) else list(sort)
+
+
+def bounding_fields(filter_dict: dict) -> List[Set[str]]:
+    """
+    Fields that can bound an index scan, per branch of the filter (in disjunctive normal form).
+    """
+    branches = [set()]
+    for key, value in filter_dict.items():
+        if key == "$and":
+            parts = [bounding_fields(part) for part in value]
+        elif key == "$or":
+            parts = [[branch for part in value for branch in bounding_fields(part)]]
+        elif isinstance(value, dict) and set(value) <= {"$ne", "$nin", "$exists"}:
+            continue
+        else:
+            parts = [[{key}]]
+
+        for part in parts:
+            branches = [branch | other for branch in branches for other in part]
+
+    return branches
+
+
+def collection_indexes(collection: str) -> List[List[Tuple[str, int]]]:
+    return [[("_id", 1)]] + mdbc.indexes[collection]
+
+
+def test_every_helper_is_recorded():
+    reading = {name for name, function in inspect.getmembers(mdbc, inspect.isfunction)
+               if function.__module__ == mdbc.__name__
+               and re.search(r"mongo\.(find|find_one|count|aggregate)\(", inspect.getsource(function))}
+
+    recorded = {helper for helper, _, _, _ in recorder.queries} | {helper for helper, _, _, _ in recorder.pipelines}
+    assert reading - recorded == set()
+
+
+@pytest.mark.parametrize("helper,collection,filter_dict,sort", recorder.queries, ids=query_ids)
+def test_query_has_index(helper, collection, filter_dict, sort):
+    first_keys = {keys[0][0] for keys in collection_indexes(collection)}
+
+    for branch in bounding_fields(filter_dict):
+        if len(branch) == 0:
+            assert sort_keys(sort)[:1] and sort_keys(sort)[0][0] in first_keys, f"{helper} scans {collection}"
+        else:
+            assert branch & first_keys, f"{helper} has no index for {sorted(branch)} on {collection}"
+
+
+@pytest.mark.parametrize("helper,collection,pipeline,kwargs", recorder.pipelines, ids=pipeline_ids)
+def test_pipeline_sort_has_index(helper, collection, pipeline, kwargs):
+    assert kwargs.get("allowDiskUse") is True
+    assert "$sort" in pipeline[0]
+
+    sort = sort_keys(pipeline[0]["$sort"])
+    reverse = [(key, -direction) for key, direction in sort]
+    assert any(keys[:len(sort)] in (sort, reverse) for keys in collection_indexes(collection)), \
+        f"{helper} sorts {collection} by {sort} without an index"
+
+
+@pytest.fixture(scope="module")
+def mongo():
+    client = real_mongo_client(mongo_uri, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"no mongod reachable at {mongo_uri}")
+
+    # MongoAPI connects to an srv address, the client is replaced
+    api = MongoAPI.__new__(MongoAPI)
+    api.client = client
+    api.db_name = "weather_fusion_index_tests"
+    mdbc.ensure_indexes(api)
+    yield api
+
+    client.drop_database(api.db_name)
+    client.close()
+
+
+def stages(plan: dict):
+    yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from stages(child)
+
+
+def winning_plans(explain: Any):
+    """
+    Winning plans anywhere in an explain output (an aggregation nests them in its stages).
+    """
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            else:
+                yield from winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from winning_plans(value)
+
+
+@pytest.mark.parametrize("helper,collection,filter_dict,sort", recorder.queries, ids=query_ids)
+def test_query_uses_index(mongo, helper, collection, filter_dict, sort):
+    cursor = mongo.collection(collection).find(filter_dict)
+    if sort is not None:
+        cursor = cursor.sort(sort_keys(sort))
+
+    plan_stages = list(stages(cursor.explain()["queryPlanner"]["winningPlan"]))
+    assert "COLLSCAN" not in plan_stages, " <- ".join(plan_stages)
+
+
+@pytest.mark.parametrize("helper,collection,pipeline,kwargs", recorder.pipelines, ids=pipeline_ids)
+def test_pipeline_uses_index(mongo, helper, collection, pipeline, kwargs):
+    explain = mongo.client[mongo.db_name].command("aggregate", collection, pipeline=pipeline, explain=True, **kwargs)
+
+    plans = list(winning_plans(explain))
+    assert len(plans) > 0
+    for plan in plans:
+        # the $sort is answered by the index, not sorted in memory
+        plan_stages = list(stages(plan))
+        assert "COLLSCAN" not in plan_stages and "SORT" not in plan_stages, " <- ".join(plan_stages)
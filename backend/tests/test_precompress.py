@@ -0,0 +1,42 @@
+import gzip
+import os
+
+from server import frame_binary, precompress, serializer, simplify
+
+
+def write_frame(path: str):
+    ring = [[8.5, 47.3], [8.6, 47.3], [8.6, 47.4], [8.55, 47.35], [8.5, 47.4], [8.5, 47.3]]
+    feature = {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]},
+               "properties": {"color": "#ff0000"}}
+    with open(path, "wb") as f:
+        f.write(serializer.dumps({"type": "FeatureCollection", "features": [feature]}))
+
+
+def test_write_siblings_without_details(tmp_path):
+    path = str(tmp_path / "frame.json")
+    write_frame(path)
+
+    written = precompress.write_siblings(path, details=False)
+    assert sorted(written) == sorted(path + suffix for suffix, _ in precompress.encodings.values())
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(p) for p in [path] + written)
+
+
+def test_write_sibling(tmp_path):
+    path = str(tmp_path / "frame.json")
+    write_frame(path)
+
+    data = precompress.write_sibling(path, frame_binary.encoding, 2)
+    with open(path + simplify.detail_suffix(2) + frame_binary.suffix, "rb") as f:
+        assert f.read() == data
+    with open(path + simplify.detail_suffix(2), "rb") as f:
+        detail_data = f.read()
+    with open(path, "rb") as f:
+        features = serializer.loads(f.read())["features"]
+    assert serializer.loads(detail_data)["features"] == simplify.simplify_levels(features, 2)[-1]
+
+    # the level of detail exists now, only the encoding is written
+    assert gzip.decompress(precompress.write_sibling(path, "gzip", 2)) == detail_data
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    assert precompress.write_sibling(str(tmp_path / "missing.json"), "gzip", 1) is None
+    assert precompress.write_sibling(str(tmp_path / "missing.json"), "gzip") is None
@@ -0,0 +1,114 @@
+import datetime
+import time
+
+import pytest
+
+from conftest import storage_files
+from fake_upstream import FakeUpstreamHandler
+import server.data_crawler as dc
+import server.mongo_db_common as mdbc
+from server.mongodb_data_models import RainRecord, RainRecordType
+from server.slot_tracker import SlotBackoff
+
+
+@pytest.fixture(autouse=True)
+def radar_backoff(monkeypatch):
+    monkeypatch.setattr(dc, "radar_backoff", SlotBackoff(60, 3600))
+
+
+def radar_hits(dt: datetime.datetime) -> int:
+    return FakeUpstreamHandler.hits.get(f"/radar/rzc/radar_rzc.{dt.strftime('%Y%m%d_%H%M')}.json", 0)
+
+
+def test_crawl_radar_backfills_holes(monkeypatch):
+    update_time = datetime.datetime.now(datetime.UTC)
+    first_dt = update_time - datetime.timedelta(minutes=update_time.minute % 5, seconds=update_time.second,
+                                                microseconds=update_time.microsecond) - datetime.timedelta(days=1)
+    first_dt += datetime.timedelta(minutes=5)
+    slots = [first_dt + datetime.timedelta(minutes=5 * i) for i in range(288)]
+    assert slots[-1] < update_time
+
+    # a hole in the middle of the timeline: a frame, a 404, a failing request and a frame
+    hole = slots[140:144]
+    mdbc.insert_radar_records(dc.mongo, [RainRecord(dt=dt, type=RainRecordType.radar, processed=True, digest="radar")
+                                         for dt in slots if dt not in hole])
+    FakeUpstreamHandler.missing = {hole[1].strftime("%Y%m%d_%H%M")}
+
+    request = dc.request_radar_data
+    failing = {hole[2]}
+
+    def flaky_request(dt: datetime.datetime):
+        if dt in failing:
+            raise ConnectionError("connection reset")
+        return request(dt)
+
+    monkeypatch.setattr(dc, "request_radar_data", flaky_request)
+
+    assert dc.crawl_radar(update_time)
+    assert mdbc.get_radar_dts(dc.mongo, first_dt, update_time) == set(slots) - {hole[1], hole[2]}
+    assert [radar_hits(dt) for dt in hole] == [1, 1, 0, 1]
+    # only the hole is requested
+    assert sum(hits for path, hits in FakeUpstreamHandler.hits.items() if path.startswith("/radar/")) == 3
+    assert not [name for name in storage_files() if name.startswith("temp_")]
+
+    # the failed slot is retried right away, the 404 is not
+    failing.clear()
+    assert dc.crawl_radar(update_time)
+    assert mdbc.get_radar_dts(dc.mongo, first_dt, update_time) == set(slots) - {hole[1]}
+    assert [radar_hits(dt) for dt in hole] == [1, 1, 1, 1]
+
+    assert not dc.crawl_radar(update_time)
+    assert [radar_hits(dt) for dt in hole] == [1, 1, 1, 1]
+
+    # once the delay has passed the 404 slot is requested again
+    FakeUpstreamHandler.missing = set()
+    monotonic = time.monotonic
+    monkeypatch.setattr(time, "monotonic", lambda: monotonic() + 61)
+    assert dc.crawl_radar(update_time)
+    assert mdbc.get_radar_dts(dc.mongo, first_dt, update_time) == set(slots)
+    assert [radar_hits(dt) for dt in hole] == [1, 2, 1, 1]
+    assert not [name for name in storage_files() if name.startswith("temp_")]
+
+
+def test_crawl_radar_retries_unpublished_slot():
+    update_time = datetime.datetime.now(datetime.UTC)
+    first_dt = update_time - datetime.timedelta(minutes=update_time.minute % 5, seconds=update_time.second,
+                                                microseconds=update_time.microsecond) - datetime.timedelta(days=1)
+    first_dt += datetime.timedelta(minutes=5)
+    slots = [first_dt + datetime.timedelta(minutes=5 * i) for i in range(288)]
+    newest = slots[-1]
+
+    mdbc.insert_radar_records(dc.mongo, [RainRecord(dt=dt, type=RainRecordType.radar, processed=True, digest="radar")
+                                         for dt in slots[:-1]])
+    FakeUpstreamHandler.missing = {newest.strftime("%Y%m%d_%H%M")}
+
+    # the newest slot is not published yet, it's not backed off
+    assert not dc.crawl_radar(update_time)
+    assert not dc.crawl_radar(update_time)
+    assert radar_hits(newest) == 2
+
+    FakeUpstreamHandler.missing = set()
+    assert dc.crawl_radar(update_time)
+    assert radar_hits(newest) == 3
+    assert mdbc.get_radar_dts(dc.mongo, first_dt, update_time) == set(slots)
+
+
+def test_slot_backoff():
+    backoff = SlotBackoff(60, 200)
+    dt = datetime.datetime(2027, 1, 1, tzinfo=datetime.UTC)
+
+    assert backoff.due(dt, 0)
+    backoff.miss(dt, 0)
+    assert not backoff.due(dt, 59) and backoff.due(dt, 60)
+    backoff.miss(dt, 60)
+    assert not backoff.due(dt, 179) and backoff.due(dt, 180)
+    backoff.miss(dt, 180)
+    # capped at the maximum delay
+    assert not backoff.due(dt, 379) and backoff.due(dt, 380)
+
+    backoff.clear([dt])
+    assert backoff.due(dt, 0)
+
+    backoff.miss(dt, 0)
+    backoff.forget_before(dt + datetime.timedelta(minutes=5))
+    assert backoff.due(dt, 0)
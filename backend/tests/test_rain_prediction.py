@@ -0,0 +1,58 @@
+import datetime
+
+import pytest
+
+from conftest import storage_files
+from fake_upstream import FakeUpstreamHandler
+import server.data_crawler as dc
+import server.mongo_db_common as mdbc
+
+version = datetime.datetime(2026, 10, 18, 12, 0, tzinfo=datetime.UTC)
+update_time = datetime.datetime(2026, 10, 18, 12, 2, tzinfo=datetime.UTC)
+missing = [datetime.datetime(2026, 10, 18, 14, 0, tzinfo=datetime.UTC),
+           datetime.datetime(2026, 10, 19, 3, 35, tzinfo=datetime.UTC)]
+
+
+def test_update_rain_prediction():
+    FakeUpstreamHandler.missing = {dt.strftime("%Y%m%d_%H%M") for dt in missing}
+
+    dc.update_rain_prediction(version, update_time)
+
+    records = dc.mongo.find(collection="rain_data", filter_dict={"type": "prediction"}, sort=[("_id", 1)])
+    dts = [record["dt"].replace(tzinfo=datetime.UTC) for record in records]
+
+    # the slots after the update up to two days after its slot, committed in timestamp order
+    assert len(dts) == 2 * 288 - 1 - len(missing)
+    assert dts == sorted(dts)
+    assert dts[0] == datetime.datetime(2026, 10, 18, 12, 5, tzinfo=datetime.UTC)
+    assert not set(missing) & set(dts)
+
+    # every frame was fetched once, the identical frames share one blob
+    rate_hits = {path: hits for path, hits in FakeUpstreamHandler.hits.items() if "/rate_" in path}
+    assert len(rate_hits) == 2 * 288 - 1 and set(rate_hits.values()) == {1}
+    digests = {record["digest"] for record in records}
+    assert len(digests) == 1
+    assert f"{digests.pop()}.json" in storage_files()
+    assert not [name for name in storage_files() if name.startswith("temp_")]
+
+    assert mdbc.get_rain_prediction_version(dc.mongo) == version
+
+
+def test_update_rain_prediction_failure_removes_temp_files(monkeypatch):
+    insert = mdbc.insert_prediction_record
+    inserted = []
+
+    def failing_insert(mongo, record):
+        if len(inserted) == 3:
+            raise RuntimeError("database gone")
+        inserted.append(record.dt)
+        return insert(mongo, record)
+
+    monkeypatch.setattr(dc.mdbc, "insert_prediction_record", failing_insert)
+
+    with pytest.raises(RuntimeError):
+        dc.update_rain_prediction(version, update_time)
+
+    assert dc.mongo.count(collection="rain_data") == 3
+    # the frames decoded after the failure (also the ones still decoding at that time) are removed
+    assert not [name for name in storage_files() if name.startswith("temp_")]
@@ -0,0 +1,58 @@
+import numpy as np
+
+from server import simplify
+
+
+def polygon(ring: list) -> dict:
+    return {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]}, "properties": {"color": "#fff"}}
+
+
+def test_self_intersecting():
+    # square, bowtie, triangle, ring touching itself in a vertex
+    points = np.array([[0, 0], [4, 0], [4, 4], [0, 4],
+                       [0, 0], [4, 4], [4, 0], [0, 4],
+                       [0, 0], [4, 0], [0, 4],
+                       [0, 0], [4, 0], [2, 2], [4, 4], [0, 4], [2, 2]], dtype=np.int64)
+    ring = np.array([0] * 4 + [1] * 4 + [2] * 3 + [3] * 6)
+
+    assert simplify.self_intersecting(points, ring).tolist() == [1, 3]
+    # a small pair budget checks the edges in several chunks
+    assert simplify.self_intersecting(points, ring, max_pairs=2).tolist() == [1, 3]
+
+
+def test_simplify_features_falls_back_to_finer():
+    # snapped to the grid of 1 the ring folds over itself
+    folding = polygon([[0.78, 2.14], [-3.82, 2.87], [-1.82, 0.49], [-4.39, 0.99], [0.54, -0.29], [0.78, 2.14]])
+    square = polygon([[0, 0], [5.2, 0], [5.2, 4.9], [0, 4.9], [0, 0]])
+    collapsed = polygon([[0, 0], [0.1, 0], [0.1, 0.1], [0, 0]])
+    finer = [polygon([[0, 0], [1, 0], [1, 1], [0, 0]]), None, None]
+
+    result = simplify.simplify_features([folding, square, collapsed], 1.0)
+    assert result[0] is folding
+    assert result[1]["geometry"]["coordinates"] == [[[0.0, 0.0], [5.0, 0.0], [5.0, 5.0], [0.0, 5.0], [0.0, 0.0]]]
+    assert result[2] is None
+
+    assert simplify.simplify_features([folding, square, collapsed], 1.0, finer)[0] is finer[0]
+    assert simplify.simplify_features([collapsed], 1.0) == [None]
+
+
+def test_simplify_levels():
+    rng = np.random.default_rng(3)
+    features = []
+    for _ in range(200):
+        # star shaped (so simple) polygons of a few vertices
+        count = rng.integers(5, 40)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, count))
+        radii = rng.uniform(0.001, 0.03, count)
+        center = rng.uniform(0, 1, 2)
+        ring = np.round(center + np.c_[radii * np.cos(angles), radii * np.sin(angles)], 5).tolist()
+        features.append(polygon(ring + ring[:1]))
+
+    levels = simplify.simplify_levels(features)
+    assert len(levels) == len(simplify.grids)
+
+    for detail_features in levels:
+        rings = [feature["geometry"]["coordinates"][0][:-1] for feature in detail_features]
+        points = np.round(np.array([point for ring in rings for point in ring]) / 1e-5).astype(np.int64)
+        ring_numbers = np.repeat(np.arange(len(rings)), [len(ring) for ring in rings])
+        assert len(simplify.self_intersecting(points, ring_numbers)) == 0
@@ -0,0 +1,94 @@
+import datetime
+import os
+import time
+
+from conftest import storage_dir, storage_files
+import server.data_crawler as dc
+import server.mongo_db_common as mdbc
+from server import blob_store
+from server.mongodb_data_models import RainRecord, RainRecordType
+from server.storage_reconciler import StorageReconciler, tombstone_suffix
+
+old = time.time() - 7200
+
+
+def write_frame(name: str, content: bytes, siblings=(".gz", ".d1"), mtime: float = old) -> str:
+    path = os.path.join(storage_dir, name)
+    for suffix in ("",) + tuple(siblings):
+        with open(path + suffix, "wb") as f:
+            f.write(content)
+        os.utime(path + suffix, (mtime, mtime))
+
+    return path
+
+
+def reference(digest: str):
+    mdbc.insert_prediction_record(dc.mongo, RainRecord(dt=datetime.datetime(2027, 1, 1), type=RainRecordType.prediction,
+                                                       version=datetime.datetime(2027, 1, 1), digest=digest))
+
+
+def test_step_removes_unreferenced_frames():
+    write_frame("aaaa.json", b"unreferenced")
+    write_frame("bbbb.json", b"referenced")
+    write_frame("cccc.json", b"recent", mtime=time.time())
+    write_frame("dddd.json", b"claimed by an interrupted step", siblings=())
+    os.rename(os.path.join(storage_dir, "dddd.json"), os.path.join(storage_dir, "dddd.json" + tombstone_suffix))
+    reference("bbbb")
+    reference("dddd")
+
+    reconciler = StorageReconciler(storage_dir, batch_size=100, grace=3600)
+    assert reconciler.step(dc.mongo) == 3
+
+    assert storage_files() == ["bbbb.json", "bbbb.json.d1", "bbbb.json.gz", "cccc.json", "cccc.json.d1",
+                               "cccc.json.gz", "dddd.json"]
+    assert reconciler.step(dc.mongo) == 0
+
+
+def test_step_is_bounded():
+    for i in range(5):
+        write_frame(f"{i:04x}.json", b"unreferenced", siblings=())
+
+    reconciler = StorageReconciler(storage_dir, batch_size=2, grace=3600)
+    assert [reconciler.step(dc.mongo) for _ in range(4)] == [2, 2, 1, 0]
+    assert storage_files() == []
+
+    # files stored after a round are checked by the next one
+    write_frame("ffff.json", b"unreferenced", siblings=())
+    assert reconciler.step(dc.mongo) == 1
+    assert storage_files() == []
+
+
+def test_frame_touched_before_claim_is_kept():
+    path = write_frame("aaaa.json", b"frame")
+    entries = sorted(os.scandir(storage_dir), key=lambda entry: entry.name)
+    # stat at scan time, the frame is reused by the crawler before the claim
+    assert all(entry.stat().st_mtime < time.time() - 3600 for entry in entries)
+    os.utime(path)
+
+    assert StorageReconciler.remove_frame(entries, time.time() - 3600) is None
+    assert storage_files() == ["aaaa.json", "aaaa.json.d1", "aaaa.json.gz"]
+
+
+def test_commit_of_claimed_frame_stores_copy(monkeypatch):
+    temp_path = os.path.join(storage_dir, "temp.json")
+    with open(temp_path, "wb") as f:
+        f.write(b"frame")
+    digest = blob_store.file_digest(temp_path)
+    path = write_frame(f"{digest}.json", b"frame")
+    entries = [entry for entry in os.scandir(storage_dir) if entry.name != "temp.json"]
+
+    # the crawler reuses the frame after the claim, before the reconciler checks the tombstone
+    stat = os.stat
+
+    def commit_then_stat(stat_path, *args, **kwargs):
+        if stat_path.endswith(tombstone_suffix) and os.path.exists(temp_path):
+            assert blob_store.commit_frame(temp_path, "json") == digest
+        return stat(stat_path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", commit_then_stat)
+    assert StorageReconciler.remove_frame(entries, time.time() - 3600) == 3
+
+    # the siblings are gone (written by the api on first request), the main file is the copy of the crawler
+    assert storage_files() == [f"{digest}.json"]
+    with open(path, "rb") as f:
+        assert f.read() == b"frame"
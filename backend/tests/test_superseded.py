@@ -0,0 +1,109 @@
+import datetime
+import os
+
+import bson
+
+from conftest import storage_dir, storage_files
+import server.db_pruner as pruner
+import server.mongo_db_common as mdbc
+from server.mongo_db_api import object_id_to_string
+from server.mongodb_data_models import DangerRecord, WindRecord, WindRecordType
+
+base = datetime.datetime(2027, 1, 1)
+versions = [base - datetime.timedelta(hours=hours) for hours in (3, 2, 1)]
+extensions = {WindRecordType.strength: "json", WindRecordType.direction: "png"}
+
+
+def store(record_id: str, digest: str, extension: str):
+    """
+    Write the frame of a record, records without digest own theirs (with siblings).
+    """
+    if digest is None:
+        for suffix in ("", ".gz"):
+            with open(os.path.join(storage_dir, f"{record_id}.{extension}{suffix}"), "wb") as f:
+                f.write(b"frame")
+    else:
+        with open(os.path.join(storage_dir, f"{digest}.{extension}"), "wb") as f:
+            f.write(b"blob")
+
+
+def insert_wind() -> dict:
+    """
+    Insert wind records of several versions (the first one without digest), a version is missing for some hours.
+
+    :return: (type, dt) -> (id of the newest version, ids of the older versions)
+    """
+    records = {}
+    for hour in range(4):
+        dt = base + datetime.timedelta(hours=hour)
+        hour_versions = versions if hour % 2 == 0 else versions[:2] if hour == 1 else versions[2:]
+        for wt in WindRecordType:
+            for version in hour_versions:
+                digest = None if version == versions[0] else f"wind{hour}{version.hour}{wt.value}"
+                record_id = object_id_to_string(mdbc.insert_wind_record(
+                    pruner.mongo, WindRecord(dt=dt, type=wt, version=version, digest=digest)))
+                store(record_id, digest, extensions[wt])
+                records.setdefault((wt, dt), []).append(record_id)
+
+    return {key: (ids[-1], ids[:-1]) for key, ids in records.items()}
+
+
+def insert_danger() -> dict:
+    """
+    Insert danger records of several (rain version, wind version), inserted out of order.
+
+    :return: dt -> (id of the newest version, ids of the older versions)
+    """
+    records = {}
+    for slot in range(4):
+        dt = base + datetime.timedelta(minutes=5 * slot)
+        combinations = [(1, 0), (0, 2), (1, 1), (0, 0)][:slot + 1]
+        for rain, wind in combinations:
+            digest = None if (rain, wind) == (0, 0) else "danger"
+            record_id = object_id_to_string(mdbc.insert_danger_record(pruner.mongo, DangerRecord(
+                dt=dt, wind_id=str(bson.ObjectId()), rain_id=str(bson.ObjectId()), rain_version=versions[rain],
+                wind_version=versions[wind], digest=digest)))
+            store(record_id, digest, "json")
+            records.setdefault(dt, []).append(((rain, wind), record_id))
+
+    result = {}
+    for dt, ranked in records.items():
+        ranked.sort()
+        result[dt] = (ranked[-1][1], [record_id for _, record_id in ranked[:-1]])
+
+    return result
+
+
+def test_prune_superseded():
+    wind = insert_wind()
+    danger = insert_danger()
+    before = set(storage_files())
+
+    pruner.prune_superseded()
+
+    kept_wind = {}
+    for record in pruner.mongo.find(collection="wind_data"):
+        key = (WindRecordType(record["type"]), record["dt"])
+        kept_wind.setdefault(key, []).append(object_id_to_string(record["_id"]))
+    assert kept_wind == {key: [newest] for key, (newest, _) in wind.items()}
+
+    kept_danger = {}
+    for record in pruner.mongo.find(collection="danger_data"):
+        kept_danger.setdefault(record["dt"], []).append(object_id_to_string(record["_id"]))
+    assert kept_danger == {dt: [newest] for dt, (newest, _) in danger.items()}
+
+    # the pruner removes the frames owned by the superseded records, the blobs are left to the storage reconciler
+    deleted = {f"{record_id}.{extensions[wt]}{suffix}" for (wt, _), (_, older) in wind.items()
+               for record_id in older for suffix in ("", ".gz")}
+    deleted |= {f"{record_id}.json{suffix}" for _, (_, older) in danger.items() for record_id in older
+                for suffix in ("", ".gz")}
+    deleted &= before
+    assert len(deleted) > 0
+    assert before - set(storage_files()) == deleted
+
+    # nothing left to prune
+    after = storage_files()
+    counts = pruner.mongo.count(collection="wind_data"), pruner.mongo.count(collection="danger_data")
+    pruner.prune_superseded()
+    assert storage_files() == after
+    assert (pruner.mongo.count(collection="wind_data"), pruner.mongo.count(collection="danger_data")) == counts